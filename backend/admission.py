@@ -0,0 +1,108 @@
+import json
+import os
+import time
+import uuid
+
+from loguru import logger
+
+from shared_state import FileLock, atomic_write_json
+
+
+class AdmissionRejected(Exception):
+    """请求超出准入限制，应以 status_code 拒绝并在 Retry-After 秒后重试。"""
+
+    def __init__(self, message, retry_after=None, status_code=429):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class IngestLimiter:
+    """跨进程的上传准入控制。
+
+    每个正在接收的上传请求在状态文件中登记一条租约（客户端、字节数、进程ID），
+    所有 API worker 在同一把文件锁内检查：并发上传总数、单个客户端的并发上传数
+    和正在接收的总字节数。超出限制时立即拒绝，而不是先接收并解码请求体。
+    进程异常退出留下的租约按进程是否存在或 lease_ttl 过期自动清除。
+    """
+
+    def __init__(self, state_file, max_concurrent=4, max_per_client=2, max_inflight_bytes=0,
+                 max_request_bytes=0, retry_after=5, lease_ttl=3600):
+        self.state_file = state_file
+        self.lock = FileLock(state_file + '.lock')
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_request_bytes = max_request_bytes
+        self.retry_after = retry_after
+        self.lease_ttl = lease_ttl
+
+    def _load(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, Exception) as e:
+            logger.error(f"读取上传准入状态时出错: {e}")
+            return {}
+
+    def _alive(self, lease, now):
+        if now - lease.get('startedAt', 0) > self.lease_ttl:
+            return False
+        if os.name == 'posix':
+            try:
+                os.kill(lease.get('pid', 0), 0)
+            except ProcessLookupError:
+                return False
+            except OSError:
+                pass  # 进程存在但属于其他用户
+        return True
+
+    def acquire(self, client, size):
+        # 登记一个上传请求，返回租约ID；超出限制时抛出 AdmissionRejected。
+        # size 为 None 表示请求没有 Content-Length，启用了大小限制时无法准入
+        if size is None:
+            if self.max_request_bytes or self.max_inflight_bytes:
+                raise AdmissionRejected("上传请求必须带有 Content-Length", status_code=411)
+            size = 0
+        if self.max_request_bytes and size > self.max_request_bytes:
+            raise AdmissionRejected(f"上传请求过大，单次最多 {self.max_request_bytes // (1024 * 1024)} MB，请分批上传",
+                                    status_code=413)
+        now = time.time()
+        with self.lock:
+            leases = {lease_id: lease for lease_id, lease in self._load().items() if self._alive(lease, now)}
+            if self.max_concurrent and len(leases) >= self.max_concurrent:
+                raise AdmissionRejected("服务器正在处理其他上传，请稍后重试", self.retry_after)
+            if self.max_per_client and sum(1 for lease in leases.values()
+                                           if lease['client'] == client) >= self.max_per_client:
+                raise AdmissionRejected("您的上传请求过多，请等待当前上传完成后重试", self.retry_after)
+            # 至少允许一个请求通过，否则超过总字节限制的单个请求永远无法上传
+            inflight = sum(lease['bytes'] for lease in leases.values())
+            if self.max_inflight_bytes and leases and inflight + size > self.max_inflight_bytes:
+                raise AdmissionRejected("服务器正在接收的上传数据过多，请稍后重试", self.retry_after)
+
+            lease_id = uuid.uuid4().hex
+            leases[lease_id] = {'client': client, 'bytes': size, 'pid': os.getpid(), 'startedAt': now}
+            atomic_write_json(self.state_file, leases)
+        return lease_id
+
+    def release(self, lease_id):
+        with self.lock:
+            leases = self._load()
+            if leases.pop(lease_id, None) is not None:
+                atomic_write_json(self.state_file, leases)
+
+    def snapshot(self):
+        # 当前正在接收的上传请求数和字节数
+        now = time.time()
+        leases = [lease for lease in self._load().values() if self._alive(lease, now)]
+        return {
+            'active': len(leases),
+            'bytes': sum(lease['bytes'] for lease in leases),
+            'maxConcurrent': self.max_concurrent,
+            'maxPerClient': self.max_per_client,
+            'maxInflightBytes': self.max_inflight_bytes,
+            'maxRequestBytes': self.max_request_bytes,
+        }
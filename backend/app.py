@@ -3,16 +3,23 @@ import hashlib
 import json
 import os
 import sys
+import threading
+import time
 import uuid
 from typing import List, Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from loguru import logger
 from pydantic import BaseModel
-from pydub import AudioSegment
+from starlette.concurrency import run_in_threadpool
+
+from admission import AdmissionRejected, IngestLimiter
+from retention import MB, RetentionManager, RetentionPolicy
+from scheduler import RenderScheduler, parse_peak_hours
+from shared_state import TERMINAL_STATUSES, FileLock, TaskStore, atomic_write_json
 
 # 配置loguru
 logger.remove()  # 移除默认处理器
@@ -22,22 +29,147 @@ logger.add(
            "function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
     level="INFO"
 )
+LOGS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
 logger.add(
-    "backend/logs/app.log",
+    os.path.join(LOGS_FOLDER, "app.log"),
     rotation="10 MB",
     retention="7 days",
     compression="zip",
     level="DEBUG",
-    format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} - {message}"
+    format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} - {message}",
+    delay=True  # 第一次写日志时才创建日志文件
 )
 
 app = FastAPI()
 
-# 配置CORS - 默认允许所有源，但可以通过环境变量限制
-
 # 加载环境变量
 load_dotenv()
 
+
+def env_number(name, default=0):
+    return float(os.getenv(name, str(default)))
+
+
+# 数据目录，默认为后端目录；多个 worker 进程通过该目录下的文件共享状态
+DATA_DIR = os.getenv("DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+# 配置上传文件夹和处理后文件夹的路径
+UPLOAD_FOLDER = os.path.join(DATA_DIR, 'uploads')
+PROCESSED_FOLDER = os.path.join(DATA_DIR, 'processed')
+TASKS_FOLDER = os.path.join(DATA_DIR, 'tasks')
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+
+# 存储音频文件元数据的文件路径
+METADATA_FILE = os.path.join(DATA_DIR, 'audio_metadata.json')
+
+# 存储定时渲染计划任务的文件路径
+SCHEDULE_FILE = os.path.join(DATA_DIR, 'render_schedules.json')
+
+# 保护元数据"读取-修改-写回"过程的跨进程锁，避免并发请求和多个 worker 互相覆盖
+metadata_lock = FileLock(METADATA_FILE + '.lock')
+
+# 稀疏排序键的间隔：移动单个文件时只需在相邻两个键之间取中间值，间隔耗尽时再整体重排
+ORDER_STEP = 1024
+
+# 存储处理任务的ID和状态，保存在磁盘上供所有 worker 进程共享
+task_store = TaskStore(TASKS_FOLDER)
+
+# 已结束的任务状态保留的时长（秒）
+TASK_TTL = 60 * 60
+
+# 清理已结束任务的间隔（秒）
+TASK_PRUNE_INTERVAL = 5 * 60
+
+# 渲染缓存版本，修改合并或导出流程时递增，使旧的缓存结果失效
+RENDER_CACHE_VERSION = 1
+
+# 查找或创建合并任务时持有的跨进程锁，保证相同请求只会加入同一个任务
+render_cache_lock = FileLock(os.path.join(TASKS_FOLDER, '.render.lock'))
+
+# 合并任务的执行方式：embedded 在 API 进程内执行；external 由独立的合并 worker 进程（worker.py）执行
+MERGE_WORKER_MODE = os.getenv("MERGE_WORKER", "embedded")
+
+# 同时执行的合并任务数
+MERGE_CONCURRENCY = int(os.getenv("MERGE_CONCURRENCY", "2"))
+
+# 线程池，用于执行耗时的音频处理任务；在第一次领取合并任务时才创建，
+# 生产模式下只处理请求的 API worker 不会创建
+thread_pool = None
+thread_pool_lock = threading.Lock()
+
+
+def get_thread_pool():
+    global thread_pool
+    with thread_pool_lock:
+        if thread_pool is None:
+            thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=MERGE_CONCURRENCY,
+                                                                thread_name_prefix="merge")
+        return thread_pool
+
+# --- 准入控制 ---
+# 单个上传文件和单次上传请求的大小上限、单次上传的文件数上限（0 表示不限制）
+UPLOAD_MAX_FILE_MB = env_number("UPLOAD_MAX_FILE_MB", 200)
+UPLOAD_MAX_REQUEST_BYTES = int(env_number("UPLOAD_MAX_REQUEST_MB", 500) * MB)
+UPLOAD_MAX_FILES = int(env_number("UPLOAD_MAX_FILES", 20))
+
+# 同时接收的上传请求数和字节数由所有 API worker 共享计数
+ingest_limiter = IngestLimiter(
+    os.path.join(TASKS_FOLDER, '.ingest.json'),
+    max_concurrent=int(env_number("UPLOAD_MAX_CONCURRENT", 4)),
+    max_per_client=int(env_number("UPLOAD_MAX_CONCURRENT_PER_CLIENT", 2)),
+    max_inflight_bytes=int(env_number("UPLOAD_MAX_INFLIGHT_MB", 1024) * MB),
+    max_request_bytes=UPLOAD_MAX_REQUEST_BYTES,
+    retry_after=int(env_number("UPLOAD_RETRY_AFTER_SECONDS", 5)),
+)
+
+# 排队等待的合并任务总数、单个客户端未完成的合并任务数（定时渲染不受限制）
+MERGE_QUEUE_MAX = int(env_number("MERGE_QUEUE_MAX", 20))
+MERGE_QUEUE_PER_CLIENT = int(env_number("MERGE_QUEUE_PER_CLIENT", 3))
+MERGE_RETRY_AFTER = int(env_number("MERGE_RETRY_AFTER_SECONDS", 30))
+
+
+# 按客户端地址区分请求来源；经反向代理部署时由 uvicorn 的 --proxy-headers 还原真实地址
+def client_key(request: Request):
+    return request.client.host if request.client else 'unknown'
+
+
+def admission_response(e: AdmissionRejected):
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return JSONResponse(status_code=e.status_code, content={"detail": e.message}, headers=headers)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, e: AdmissionRejected):
+    logger.warning(f"拒绝来自 {client_key(request)} 的请求 {request.url.path}: {e.message}")
+    return admission_response(e)
+
+
+# 上传准入控制：在接收请求体之前检查限制，超出时立即返回 429，不再接收和解码上传的文件
+@app.middleware("http")
+async def upload_admission(request: Request, call_next):
+    if request.method != 'POST' or request.url.path != '/api/upload':
+        return await call_next(request)
+
+    # 请求体不会超过 Content-Length（由 uvicorn 保证）；没有 Content-Length 的分块上传无法在接收前判断大小，
+    # 启用大小限制时由 ingest_limiter 以 411 拒绝
+    content_length = request.headers.get('content-length', '')
+    size = int(content_length) if content_length.isdigit() else None
+    try:
+        lease_id = await run_in_threadpool(ingest_limiter.acquire, client_key(request), size)
+    except AdmissionRejected as e:
+        logger.warning(f"拒绝来自 {client_key(request)} 的上传请求 ({content_length or '未知'} 字节): {e.message}")
+        return admission_response(e)
+
+    try:
+        return await call_next(request)
+    finally:
+        await run_in_threadpool(ingest_limiter.release, lease_id)
+
+
+# 配置CORS - 默认允许所有源，但可以通过环境变量限制。
+# CORS 中间件最后添加，位于最外层，准入控制返回的 429 响应也会带上跨域响应头
+
 # 获取允许的源，默认为所有
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
@@ -47,28 +179,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
-# 配置上传文件夹和处理后文件夹的路径
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-PROCESSED_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processed')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
-
-# 存储音频文件元数据的文件路径
-METADATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio_metadata.json')
-
-# 存储当前处理任务的ID和状态
-processing_tasks = {}
-
-# 创建线程池，用于执行耗时的音频处理任务
-thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)  # 最多同时处理2个音频合成任务
-
 
 # 数据模型
 class AudioUpdate(BaseModel):
     displayName: Optional[str] = None
     order: Optional[int] = None
+    pinned: Optional[bool] = None  # 置顶的已处理文件不会被存储清理删除
 
 
 class MergeRequest(BaseModel):
@@ -83,33 +202,95 @@ class ReorderRequest(BaseModel):
     newOrder: List[str]
 
 
+class MoveRequest(BaseModel):
+    beforeId: Optional[str] = None  # 移动到该文件之前，为空时移动到末尾
+
+
+class ScheduleRequest(BaseModel):
+    name: str
+    audioIds: List[str]
+    outputName: str
+    time: str  # 播出时间，格式 HH:MM
+    weekdays: List[int] = [0, 1, 2, 3, 4, 5, 6]  # 0 表示周一
+    normalizeVolume: bool = False
+    normalizeTargetDb: float = -3.0
+    enabled: bool = True
+
+
+class ScheduleUpdate(BaseModel):
+    name: Optional[str] = None
+    audioIds: Optional[List[str]] = None
+    outputName: Optional[str] = None
+    time: Optional[str] = None
+    weekdays: Optional[List[int]] = None
+    normalizeVolume: Optional[bool] = None
+    normalizeTargetDb: Optional[float] = None
+    enabled: Optional[bool] = None
+
+
 # --- 元数据加载和保存 ---
+# 元数据缓存：文件未变化时直接返回缓存的副本，不再重新读取和解析。
+# 元数据总是通过原子替换写入，本进程或其他 worker 写入后文件的修改时间和 inode 都会变化，缓存随之失效
+metadata_cache = {'key': None, 'data': []}
+metadata_cache_lock = threading.Lock()
+
+
 def load_metadata():
-    if os.path.exists(METADATA_FILE):
-        try:
-            with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-                content = f.read()
-                if not content:
-                    return []
-                data = json.loads(content)
+    try:
+        stat = os.stat(METADATA_FILE)
+    except FileNotFoundError:
+        return []
+    cache_key = (stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size, stat.st_ino)
+
+    with metadata_cache_lock:
+        if metadata_cache['key'] != cache_key:
+            try:
+                with open(METADATA_FILE, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                data = json.loads(content) if content else []
                 for item in data:
                     if 'hash' not in item:
                         item['hash'] = ''
-                return data
-        except (json.JSONDecodeError, Exception) as e:
-            logger.error(f"加载元数据时出错: {e}")
-            return []
-    return []
+            except (json.JSONDecodeError, Exception) as e:
+                logger.error(f"加载元数据时出错: {e}")
+                return []
+            metadata_cache['key'] = cache_key
+            metadata_cache['data'] = data
+        # 调用方会修改返回的元数据，每条记录都返回副本
+        return [dict(item) for item in metadata_cache['data']]
 
 
 def save_metadata(metadata):
     try:
-        with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        atomic_write_json(METADATA_FILE, metadata)
     except Exception as e:
         logger.error(f"保存元数据时出错: {e}")
 
 
+# 记录文件的最近使用时间，供存储清理的 LRU 策略使用
+def touch_metadata(audio_ids):
+    audio_ids = set(audio_ids)
+    with metadata_lock:
+        metadata = load_metadata()
+        for item in metadata:
+            if item['id'] in audio_ids:
+                item['lastAccessedAt'] = time.time()
+        save_metadata(metadata)
+
+
+# --- 稀疏排序键 ---
+def rebalance_order(unmerged_items):
+    # 按当前顺序将未合并文件的排序键重新均匀分布
+    for i, item in enumerate(unmerged_items):
+        item['order'] = (i + 1) * ORDER_STEP
+
+
+def next_order_key(metadata):
+    # 新文件追加到末尾：在当前最大排序键之后留出一个间隔
+    orders = [item.get('order', 0) for item in metadata if not item.get('merged', False)]
+    return (max(orders) if orders else 0) + ORDER_STEP
+
+
 # --- 文件哈希计算 ---
 # 计算文件的 SHA256 哈希值，分块读取以处理大文件
 async def calculate_sha256(file: UploadFile):
@@ -128,19 +309,23 @@ async def calculate_sha256(file: UploadFile):
 async def upload_audio(files: List[UploadFile] = File(...)):
     if not files:
         raise HTTPException(status_code=400, detail="没有文件部分")
+    if UPLOAD_MAX_FILES and len(files) > UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"单次最多上传 {UPLOAD_MAX_FILES} 个文件，请分批上传")
+    for file in files:
+        if UPLOAD_MAX_FILE_MB and file.size and file.size > UPLOAD_MAX_FILE_MB * MB:
+            raise HTTPException(status_code=413,
+                                detail=f"文件 {file.filename} 超过大小限制 ({UPLOAD_MAX_FILE_MB:g} MB)")
 
     metadata = load_metadata()
     # 存储本次处理结果的元数据列表 (包括新上传和标记为重复的)
     uploaded_metadata_results = []
+    # 本次新上传文件的元数据，处理完成后统一写入
+    new_metadata = []
 
     # 创建哈希到已存在未合并文件元数据的映射
     existing_unmerged_hashes = {item['hash']: item for item in metadata if
                                 not item.get('merged', False) and item.get('hash')}
 
-    # 获取当前未合并文件的数量，用于计算新文件的初始顺序
-    current_unmerged_count = len([item for item in metadata if not item.get('merged', False)])
-    new_file_order_counter = current_unmerged_count + 1
-
     # 遍历上传的文件列表
     for file in files:
         original_filename = os.path.basename(file.filename)
@@ -182,35 +367,67 @@ async def upload_audio(files: List[UploadFile] = File(...)):
                 'displayName': original_filename,
                 'filename': unique_filename,
                 'path': file_path,
-                'order': new_file_order_counter,
+                'order': 0,  # 写入元数据时再分配排序键
                 'duration': 0,
                 'merged': False,
                 'hash': uploaded_hash
             }
 
-            # 尝试获取音频时长
+            # 尝试获取音频时长；解码放到线程池中执行，避免阻塞事件循环
             try:
-                audio = AudioSegment.from_file(file_path)
+                from pydub import AudioSegment  # pydub 导入较慢，第一次解码音频时才导入
+                audio = await run_in_threadpool(AudioSegment.from_file, file_path)
                 file_metadata['duration'] = len(audio) / 1000
             except Exception as e:
                 logger.error(f"无法获取文件 {original_filename} 的音频时长: {e}")
 
-            # 将新文件的元数据添加到总元数据列表和本次处理结果列表
-            metadata.append(file_metadata)
+            # 将新文件的元数据添加到新增列表和本次处理结果列表
+            new_metadata.append(file_metadata)
             uploaded_metadata_results.append(file_metadata)
 
-            # 递增顺序计数器
-            new_file_order_counter += 1
-
         except Exception as e:
             logger.error(f"处理文件 {original_filename} 时出错: {e}")
             # 如果处理单个文件出错，可以记录错误并继续处理下一个
 
-    # 保存更新后的元数据到文件
-    save_metadata(metadata)
+    # 写入元数据时可能等待其他进程释放锁，放到线程池中执行以免阻塞事件循环
+    late_duplicates = await run_in_threadpool(commit_uploaded_metadata, new_metadata)
 
     # 返回本次处理（包括新上传和标记为重复）的文件的元数据列表
-    return uploaded_metadata_results
+    return [late_duplicates.get(item['id'], item) for item in uploaded_metadata_results]
+
+
+# 重新加载最新的元数据并追加新文件，避免覆盖上传期间其他请求、其他 worker 或存储清理做出的修改。
+# 其他 worker 可能同时上传了相同内容的文件，这里再查重一次，返回 {新文件ID: 重复结果}
+def commit_uploaded_metadata(new_metadata):
+    late_duplicates = {}
+    with metadata_lock:
+        metadata = load_metadata()
+        existing_unmerged_hashes = {item['hash']: item for item in metadata if
+                                    not item.get('merged', False) and item.get('hash')}
+        # 新文件的排序键追加在当前最大排序键之后
+        new_file_order_counter = next_order_key(metadata)
+
+        for file_metadata in new_metadata:
+            duplicate_item = existing_unmerged_hashes.get(file_metadata['hash'])
+            if duplicate_item:
+                logger.info(f"文件 {file_metadata['originalName']} 已被其他请求上传，删除本次保存的副本")
+                try:
+                    os.remove(file_metadata['path'])
+                except Exception as e:
+                    logger.error(f"删除重复文件 {file_metadata['path']} 时出错: {e}")
+                duplicate_result = duplicate_item.copy()
+                duplicate_result['isDuplicate'] = True
+                duplicate_result['uploadedName'] = file_metadata['originalName']
+                late_duplicates[file_metadata['id']] = duplicate_result
+                continue
+
+            file_metadata['order'] = new_file_order_counter
+            new_file_order_counter += ORDER_STEP
+            metadata.append(file_metadata)
+            existing_unmerged_hashes[file_metadata['hash']] = file_metadata
+
+        save_metadata(metadata)
+    return late_duplicates
 
 
 # GET /api/audio: 获取所有未合并的音频文件元数据
@@ -233,141 +450,145 @@ def get_processed_files():
 # PUT /api/audio/{audio_id}: 更新未合并音频文件的元数据
 @app.put("/api/audio/{audio_id}")
 def update_audio(audio_id: str, data: AudioUpdate):
-    metadata = load_metadata()
-    for item in metadata:
-        if item['id'] == audio_id and not item.get('merged', False):
-            if data.displayName is not None:
-                item['displayName'] = data.displayName
-            save_metadata(metadata)
-            return item
-    raise HTTPException(status_code=404, detail="未找到未处理的音频文件")
+    with metadata_lock:
+        metadata = load_metadata()
+        for item in metadata:
+            if item['id'] == audio_id and not item.get('merged', False):
+                if data.displayName is not None:
+                    item['displayName'] = data.displayName
+                save_metadata(metadata)
+                return item
+        raise HTTPException(status_code=404, detail="未找到未处理的音频文件")
 
 
 # PUT /api/processed/{audio_id}: 更新已合并音频文件的元数据
 @app.put("/api/processed/{audio_id}")
 def update_processed(audio_id: str, data: AudioUpdate):
-    metadata = load_metadata()
-    for item in metadata:
-        if item['id'] == audio_id and item.get('merged', False):
-            if data.displayName is not None:
-                item['displayName'] = data.displayName
-            save_metadata(metadata)
-            return item
-    raise HTTPException(status_code=404, detail="未找到已处理的音频文件")
+    with metadata_lock:
+        metadata = load_metadata()
+        for item in metadata:
+            if item['id'] == audio_id and item.get('merged', False):
+                if data.displayName is not None:
+                    item['displayName'] = data.displayName
+                if data.pinned is not None:
+                    item['pinned'] = data.pinned
+                save_metadata(metadata)
+                return item
+        raise HTTPException(status_code=404, detail="未找到已处理的音频文件")
 
 
 # DELETE /api/audio/all: 删除所有未合并的音频文件
 @app.delete("/api/audio/all")
 def delete_all_audio():
-    metadata = load_metadata()
-    new_metadata = []
-    deleted_count = 0
-    error_count = 0
+    with metadata_lock:
+        metadata = load_metadata()
+        new_metadata = []
+        deleted_count = 0
+        error_count = 0
 
-    for item in metadata:
-        if item.get('merged', False):
-            new_metadata.append(item)
-        else:
-            try:
-                if os.path.exists(item['path']):
-                    os.remove(item['path'])
-                    deleted_count += 1
-                    logger.info(f"已删除文件: {item['path']}")
-            except Exception as e:
-                error_count += 1
-                logger.error(f"删除文件 {item.get('filename', item['id'])} 时出错: {e}")
+        for item in metadata:
+            if item.get('merged', False):
+                new_metadata.append(item)
+            else:
+                try:
+                    if os.path.exists(item['path']):
+                        os.remove(item['path'])
+                        deleted_count += 1
+                        logger.info(f"已删除文件: {item['path']}")
+                except Exception as e:
+                    error_count += 1
+                    logger.error(f"删除文件 {item.get('filename', item['id'])} 时出错: {e}")
 
-    logger.info(f"成功删除 {deleted_count} 个文件，处理失败 {error_count} 个文件")
-    save_metadata(new_metadata)
-    return {"success": True, "message": f"所有未处理音频文件已删除，共 {deleted_count} 个"}
+        logger.info(f"成功删除 {deleted_count} 个文件，处理失败 {error_count} 个文件")
+        save_metadata(new_metadata)
+        return {"success": True, "message": f"所有未处理音频文件已删除，共 {deleted_count} 个"}
 
 
 # DELETE /api/processed/all: 删除所有已合并的音频文件
 @app.delete("/api/processed/all")
 def delete_all_processed():
-    metadata = load_metadata()
-    new_metadata = []
-    deleted_count = 0
-    error_count = 0
+    with metadata_lock:
+        metadata = load_metadata()
+        new_metadata = []
+        deleted_count = 0
+        error_count = 0
 
-    for item in metadata:
-        if not item.get('merged', False):
-            new_metadata.append(item)
-        else:
-            try:
-                if os.path.exists(item['path']):
-                    os.remove(item['path'])
-                    deleted_count += 1
-                    logger.info(f"已删除已处理文件: {item['path']}")
-            except Exception as e:
-                error_count += 1
-                logger.error(f"删除文件 {item.get('filename', item['id'])} 时出错: {e}")
+        for item in metadata:
+            if not item.get('merged', False):
+                new_metadata.append(item)
+            else:
+                try:
+                    if os.path.exists(item['path']):
+                        os.remove(item['path'])
+                        deleted_count += 1
+                        logger.info(f"已删除已处理文件: {item['path']}")
+                except Exception as e:
+                    error_count += 1
+                    logger.error(f"删除文件 {item.get('filename', item['id'])} 时出错: {e}")
 
-    logger.info(f"成功删除 {deleted_count} 个已处理文件，处理失败 {error_count} 个文件")
-    save_metadata(new_metadata)
-    return {"success": True, "message": f"所有已处理音频文件已删除，共 {deleted_count} 个"}
+        logger.info(f"成功删除 {deleted_count} 个已处理文件，处理失败 {error_count} 个文件")
+        save_metadata(new_metadata)
+        return {"success": True, "message": f"所有已处理音频文件已删除，共 {deleted_count} 个"}
 
 
 # DELETE /api/audio/{audio_id}: 删除指定的未合并音频文件
 @app.delete("/api/audio/{audio_id}")
 def delete_audio(audio_id: str):
-    metadata = load_metadata()
-    item_to_delete = None
-
-    for item in metadata:
-        if item['id'] == audio_id and not item.get('merged', False):
-            item_to_delete = item
-            try:
-                if os.path.exists(item['path']):
-                    os.remove(item['path'])
-                    logger.info(f"已删除文件: {item['path']}")
-            except Exception as e:
-                logger.error(f"删除文件 {item.get('filename', audio_id)} 时出错: {e}")
-            break
-
-    if not item_to_delete:
-        raise HTTPException(status_code=404, detail="未找到未处理的音频文件")
-
-    metadata.remove(item_to_delete)
-
-    current_order = 1
-    for item in metadata:
-        if not item.get('merged', False):
-            item['order'] = current_order
-            current_order += 1
+    with metadata_lock:
+        metadata = load_metadata()
+        item_to_delete = None
 
-    save_metadata(metadata)
-    return {"success": True, "message": f"音频文件 {audio_id} 已删除"}
+        for item in metadata:
+            if item['id'] == audio_id and not item.get('merged', False):
+                item_to_delete = item
+                try:
+                    if os.path.exists(item['path']):
+                        os.remove(item['path'])
+                        logger.info(f"已删除文件: {item['path']}")
+                except Exception as e:
+                    logger.error(f"删除文件 {item.get('filename', audio_id)} 时出错: {e}")
+                break
+
+        if not item_to_delete:
+            raise HTTPException(status_code=404, detail="未找到未处理的音频文件")
+
+        # 排序键是稀疏的，删除后无需为其余文件重新编号
+        metadata.remove(item_to_delete)
+        save_metadata(metadata)
+        return {"success": True, "message": f"音频文件 {audio_id} 已删除"}
 
 
 # DELETE /api/processed/{audio_id}: 删除指定的已处理音频文件
 @app.delete("/api/processed/{audio_id}")
 def delete_processed_audio(audio_id: str):
-    metadata = load_metadata()
-    item_to_delete = None
+    with metadata_lock:
+        metadata = load_metadata()
+        item_to_delete = None
 
-    for item in metadata:
-        if item['id'] == audio_id and item.get('merged', True):
-            item_to_delete = item
-            try:
-                if os.path.exists(item['path']):
-                    os.remove(item['path'])
-                    logger.info(f"已删除已处理文件: {item['path']}")
-            except Exception as e:
-                logger.error(f"删除文件 {item.get('filename', audio_id)} 时出错: {e}")
-            break
+        for item in metadata:
+            if item['id'] == audio_id and item.get('merged', True):
+                item_to_delete = item
+                break
 
-    if not item_to_delete:
-        raise HTTPException(status_code=404, detail="未找到已处理的音频文件")
+        if not item_to_delete:
+            raise HTTPException(status_code=404, detail="未找到已处理的音频文件")
 
-    metadata.remove(item_to_delete)
-    save_metadata(metadata)
-    return {"success": True, "message": f"已处理音频文件 {audio_id} 已删除"}
+        metadata.remove(item_to_delete)
+        # 命中渲染缓存时多条记录可能指向同一文件，只有删除最后一条记录时才删除文件
+        if not any(item['path'] == item_to_delete['path'] for item in metadata):
+            try:
+                if os.path.exists(item_to_delete['path']):
+                    os.remove(item_to_delete['path'])
+                    logger.info(f"已删除已处理文件: {item_to_delete['path']}")
+            except Exception as e:
+                logger.error(f"删除文件 {item_to_delete.get('filename', audio_id)} 时出错: {e}")
+        save_metadata(metadata)
+        return {"success": True, "message": f"已处理音频文件 {audio_id} 已删除"}
 
 
 # POST /api/merge: 合并音频文件
 @app.post("/api/merge", status_code=201)
-async def merge_audio(request: MergeRequest):
+async def merge_audio(request: MergeRequest, http_request: Request):
     if not request.audioIds:
         raise HTTPException(status_code=400, detail="没有提供要合并的音频文件ID")
 
@@ -378,8 +599,9 @@ async def merge_audio(request: MergeRequest):
     merged_output_name = request.outputName.strip()
 
     # 获取请求ID，用于取消处理
-    request_id = getattr(request, 'requestId', str(uuid.uuid4()))
-    processing_tasks[request_id] = {'status': 'processing', 'cancelled': False}
+    request_id = request.requestId or str(uuid.uuid4())
+    if not task_store.valid_id(request_id):
+        raise HTTPException(status_code=400, detail="无效的请求ID")
 
     # 加载元数据
     metadata = load_metadata()
@@ -395,41 +617,308 @@ async def merge_audio(request: MergeRequest):
     # 根据 order 属性排序待合并的文件
     files_to_merge.sort(key=lambda x: x.get('order', 0))
 
-    # 创建唯一的输出文件名
-    output_filename = f"{uuid.uuid4()}.mp3"  # 使用 MP3 作为合并后的格式
-    output_path = os.path.join(PROCESSED_FOLDER, output_filename)
-
-    # 将音频处理任务提交到线程池中异步执行
-    thread_pool.submit(
-        process_audio_files,
+    # 将音频处理任务提交到合并队列，由合并线程池异步执行
+    task, cache_status = await run_in_threadpool(
+        submit_merge,
         files_to_merge,
         merged_output_name,
-        output_filename,
-        output_path,
         request_id,
         getattr(request, 'normalizeVolume', False),
-        getattr(request, 'normalizeTargetDb', -3.0)
+        getattr(request, 'normalizeTargetDb', -3.0),
+        client_key(http_request)
     )
 
+    # 相同的源文件和选项已有处理结果，直接返回
+    if cache_status == 'hit':
+        return {
+            "id": request_id,
+            "status": "completed",
+            "message": "已存在相同的处理结果",
+            "totalFiles": len(files_to_merge),
+            "cached": True,
+            "fileInfo": task['fileInfo']
+        }
+
     # 立即返回处理状态，不等待处理完成
     return {
         "id": request_id,
         "status": "processing",
-        "message": "音频处理任务已提交到后台执行",
-        "totalFiles": len(files_to_merge)
+        "message": "已加入正在处理的相同任务" if cache_status == 'joined' else "音频处理任务已提交到后台执行",
+        "totalFiles": len(files_to_merge),
+        "cached": cache_status == 'joined'
     }
 
 
+# --- 渲染缓存 ---
+# 渲染缓存键：按合并顺序排列的源文件哈希加上所有输出和音量处理选项
+def render_cache_key(files_to_merge, normalize_volume, normalize_target_db):
+    hashes = [f.get('hash') for f in files_to_merge]
+    if not all(hashes):
+        return None  # 旧数据缺少哈希，无法判断内容是否相同
+    payload = json.dumps({
+        'version': RENDER_CACHE_VERSION,
+        'sources': hashes,
+        'format': 'mp3',
+        'normalizeVolume': bool(normalize_volume),
+        'normalizeTargetDb': normalize_target_db if normalize_volume else None
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# 查找缓存键相同且文件仍然存在的处理结果，优先返回名称与本次输出名称相同的记录；
+# 处理结果被删除后其元数据随之移除，缓存自然失效
+def find_cached_render(render_key, output_name):
+    matches = [item for item in load_metadata() if item.get('merged', False)
+               and item.get('renderKey') == render_key and os.path.exists(item['path'])]
+    return next((item for item in matches if item['displayName'] == output_name), matches[0] if matches else None)
+
+
+# 缓存结果的名称与本次输出名称不同时，新增一条指向同一文件的处理结果记录。
+# 各记录可以单独重命名、置顶和删除，文件在最后一条记录删除时才会被删除
+def add_render_entry(cached, output_name):
+    entry = dict(cached, id=str(uuid.uuid4()), originalName=output_name, displayName=output_name,
+                 lastAccessedAt=time.time())
+    entry.pop('pinned', None)
+    with metadata_lock:
+        metadata = load_metadata()
+        metadata.append(entry)
+        save_metadata(metadata)
+    logger.info(f"渲染结果 {cached['id']} 以新名称 {output_name} 输出为 {entry['id']}")
+    return entry
+
+
+# 查找缓存键相同、仍在排队或执行且未被取消的合并任务
+def find_inflight_job(render_key):
+    for job_id, task in task_store.active_jobs().items():
+        if task.get('renderKey') == render_key and not task.get('cancelled', False):
+            return job_id, task
+    return None, None
+
+
+# 新建合并任务前检查队列长度，超出限制时抛出 AdmissionRejected（由异常处理器返回 429）
+def check_merge_admission(client):
+    jobs = task_store.active_jobs().values()
+    if MERGE_QUEUE_MAX and sum(1 for task in jobs if task.get('status') == 'queued') >= MERGE_QUEUE_MAX:
+        raise AdmissionRejected("合并队列已满，请稍后重试", MERGE_RETRY_AFTER)
+    if MERGE_QUEUE_PER_CLIENT and sum(1 for task in jobs if task.get('client') == client) >= MERGE_QUEUE_PER_CLIENT:
+        raise AdmissionRejected("您提交的合并任务过多，请等待已提交的任务完成后重试", MERGE_RETRY_AFTER)
+
+
+# 提交合并任务，返回 (请求的任务状态, 缓存状态)。
+# 缓存状态为 'hit'（已有结果）、'joined'（加入进行中的相同任务）或 None（新建任务）。
+# 每个请求ID只是合并任务的一个订阅者，实际进度记录在 task_store[jobId] 中；
+# 合并任务先进入队列，由本进程或独立合并 worker 中的调度线程领取执行。
+# priority 为 True 的任务（定时渲染）不受队列长度限制，并且优先被领取执行。
+def submit_merge(files_to_merge, merged_output_name, request_id, normalize_volume, normalize_target_db,
+                 client=None, priority=False):
+    render_key = render_cache_key(files_to_merge, normalize_volume, normalize_target_db)
+
+    with render_cache_lock:
+        if render_key:
+            cached = find_cached_render(render_key, merged_output_name)
+            if cached:
+                logger.info(f"命中渲染缓存 (请求ID: {request_id})，返回已有结果 {cached['id']}")
+                if cached['displayName'] == merged_output_name:
+                    touch_metadata([cached['id']])
+                else:
+                    cached = add_render_entry(cached, merged_output_name)
+                task = task_store.set(request_id, {
+                    'status': 'completed', 'cancelled': False, 'cached': True, 'fileInfo': cached,
+                    'progress': 100, 'stage': 'completed', 'message': '处理完成',
+                    'currentFileIndex': len(files_to_merge), 'totalFilesCount': len(files_to_merge)
+                })
+                return task, 'hit'
+
+            job_id, job = find_inflight_job(render_key)
+            if job:
+                logger.info(f"请求 {request_id} 加入正在处理的相同任务 {job_id}")
+                task_store.update(job_id, subscribers=job.get('subscribers', []) + [request_id])
+                task = {'status': 'processing', 'cancelled': False, 'jobId': job_id}
+                if job.get('outputName') != merged_output_name:
+                    task['outputName'] = merged_output_name  # 任务完成后以本次的名称输出，见 resolve_task
+                task = task_store.set(request_id, task)
+                return task, 'joined'
+
+        # 命中缓存和加入已有任务不增加合并负载，只有新建任务时才检查队列长度
+        if not priority:
+            check_merge_admission(client)
+
+        # 创建唯一的输出文件名
+        output_filename = f"{uuid.uuid4()}.mp3"  # 使用 MP3 作为合并后的格式
+
+        # 记录参与合并的文件，合并期间存储清理不会删除它们
+        job_id = f"render-{uuid.uuid4()}"
+        task_store.set(job_id, {
+            'kind': 'job',
+            'status': 'queued',
+            'cancelled': False,
+            'message': '等待处理',
+            'audioIds': [f['id'] for f in files_to_merge],
+            'files': files_to_merge,
+            'outputName': merged_output_name,
+            'outputFilename': output_filename,
+            'normalizeVolume': normalize_volume,
+            'normalizeTargetDb': normalize_target_db,
+            'renderKey': render_key,
+            'subscribers': [request_id],
+            'client': client,
+            'priority': priority,
+            'queuedAt': time.time()
+        })
+        task = task_store.set(request_id, {'status': 'processing', 'cancelled': False, 'jobId': job_id})
+        touch_metadata([f['id'] for f in files_to_merge])
+
+    merge_wakeup.set()
+    return task, None
+
+
+# 取消一个请求对任务的订阅；只有所有订阅者都取消后才真正停止合并
+def cancel_render_subscriber(request_id, job_id):
+    with render_cache_lock:
+        job = task_store.get(job_id)
+        if job is None or job.get('status') in TERMINAL_STATUSES:
+            return  # 任务已经结束
+        subscribers = [s for s in job.get('subscribers', []) if s != request_id]
+        if subscribers:
+            task_store.update(job_id, subscribers=subscribers)
+            logger.info(f"请求 {request_id} 已退出任务 {job_id}，仍有 {len(subscribers)} 个请求在等待结果")
+            return
+        task_store.update(job_id, subscribers=[], cancelled=True, status='cancelled')
+
+
+# 任务结束后复制到请求记录中的字段
+REQUEST_RESULT_FIELDS = ('status', 'progress', 'stage', 'message', 'fileInfo', 'currentFileIndex', 'totalFilesCount',
+                         'startedAt', 'finishedAt')
+
+
+# 任务结束（或任务记录已不存在）时，把最终状态写入请求记录。此后请求记录不再依赖任务记录，
+# 任务记录过期删除后仍能查询结果，请求记录也会按结束时间被清理。
+# 加入的任务输出名称不同时，为本请求新增一条指向同一文件的记录
+def settle_request(request_id, job_id, job):
+    with render_cache_lock:
+        task = task_store.get(request_id)
+        if not task or task.get('jobId') != job_id or task.get('status') == 'cancelled':
+            return task  # 已经结束或其他请求已经生成了记录
+        if job is None:
+            return task_store.set(request_id, {
+                'status': 'failed', 'cancelled': False, 'stage': 'failed', 'progress': 0,
+                'message': '任务记录已过期，请重新提交'
+            })
+        result = {key: job[key] for key in REQUEST_RESULT_FIELDS if key in job}
+        if job.get('status') == 'completed' and task.get('outputName'):
+            result['fileInfo'] = add_render_entry(job['fileInfo'], task['outputName'])
+        return task_store.set(request_id, dict(result, cancelled=False))
+
+
+# 任务结束后结算所有订阅者的请求记录
+def settle_subscribers(job_id):
+    job = task_store.get(job_id)
+    if job is None or job.get('status') not in TERMINAL_STATUSES:
+        return
+    for request_id in job.get('subscribers', []):
+        settle_request(request_id, job_id, job)
+
+
+# 读取请求对应的任务状态；请求只是合并任务的订阅者，未结束时返回实际任务的状态
+def resolve_task(request_id):
+    task = task_store.get(request_id)
+    if not task or task.get('status') == 'cancelled' or 'jobId' not in task:
+        return task
+    job = task_store.get(task['jobId'])
+    if job is not None and job.get('status') not in TERMINAL_STATUSES:
+        return job
+    # 任务已结束但尚未结算（如结算前进程退出），或任务记录已被清理
+    return settle_request(request_id, task['jobId'], job)
+
+
+# --- 合并任务调度 ---
+# 唤醒调度线程立即领取新任务（同一进程内）；其他进程提交的任务由调度线程定时轮询领取
+merge_wakeup = threading.Event()
+merge_stop = threading.Event()
+# 本进程正在执行的合并任务ID
+active_merge_jobs = set()
+
+
+# 领取排队中的合并任务，交给本进程的合并线程池执行
+def claim_merge_jobs():
+    free_slots = MERGE_CONCURRENCY - len(active_merge_jobs)
+    if free_slots <= 0:
+        return
+    with task_store.lock:
+        jobs = task_store.active_jobs()
+        queued = [(job_id, task) for job_id, task in jobs.items() if task.get('status') == 'queued']
+        # 各客户端正在执行的任务数，空闲的合并线程在客户端之间轮流分配
+        running = {}
+        for task in jobs.values():
+            if task.get('status') == 'processing':
+                running[task.get('client')] = running.get(task.get('client'), 0) + 1
+
+        for _ in range(min(free_slots, len(queued))):
+            # 定时渲染优先，其次是正在执行任务最少的客户端，同等情况下先到先得
+            job_id, job = min(queued, key=lambda pair: (not pair[1].get('priority', False),
+                                                      running.get(pair[1].get('client'), 0),
+                                                      pair[1].get('queuedAt', 0)))
+            queued.remove((job_id, job))
+            running[job.get('client')] = running.get(job.get('client'), 0) + 1
+            task_store.update(job_id, status='processing', message='开始处理',
+                              startedAt=time.time(), workerPid=os.getpid())
+            active_merge_jobs.add(job_id)
+            get_thread_pool().submit(run_merge_job, job_id, job)
+
+
+def run_merge_job(job_id, job):
+    try:
+        output_path = os.path.join(PROCESSED_FOLDER, job['outputFilename'])
+        process_audio_files(job['files'], job['outputName'], job['outputFilename'], output_path,
+                            job_id, job['normalizeVolume'], job['normalizeTargetDb'], job.get('renderKey'))
+    finally:
+        try:
+            settle_subscribers(job_id)
+        except Exception as e:
+            logger.error(f"更新任务 {job_id} 的请求状态时出错: {e}")
+        active_merge_jobs.discard(job_id)
+        merge_wakeup.set()
+
+
+# 合并调度线程：只在一个进程中运行（开发模式下为 API 进程，生产模式下为合并 worker 进程）
+def merge_dispatcher_loop():
+    # 上一次运行时未完成的任务已随进程退出而中断，标记为失败
+    with task_store.lock:
+        interrupted = [job_id for job_id, task in task_store.active_jobs().items() if task.get('status') == 'processing']
+        for job_id in interrupted:
+            task_store.update(job_id, status='failed', stage='failed', message='合并进程已重启，任务中断')
+    for job_id in interrupted:
+        settle_subscribers(job_id)
+
+    last_prune = 0
+    while not merge_stop.is_set():
+        try:
+            claim_merge_jobs()
+            if time.time() - last_prune > TASK_PRUNE_INTERVAL:
+                last_prune = time.time()
+                task_store.prune(TASK_TTL)
+        except Exception as e:
+            logger.error(f"调度合并任务时出错: {e}")
+        merge_wakeup.wait(0.5)
+        merge_wakeup.clear()
+
+
+def is_cancelled(job_id):
+    return (task_store.get(job_id) or {}).get('cancelled', False)
+
+
 # 后台执行音频处理的函数
 def process_audio_files(files_to_merge, merged_output_name, output_filename, output_path,
-                        request_id, normalize_volume, normalize_target_db):
+                        request_id, normalize_volume, normalize_target_db, render_key=None):
     logger.info(f"开始后台处理音频文件 (请求ID: {request_id})")
 
     try:
+        from pydub import AudioSegment  # pydub 导入较慢，第一次合并时才导入
+
         # 这里执行音频合并操作
         if not files_to_merge:
             logger.error("没有有效的音频文件可合并")
-            processing_tasks[request_id]['status'] = 'failed'
+            task_store.update(request_id, status='failed', stage='failed', message="没有有效的音频文件可合并")
             return
 
         # 创建合并后的音频段
@@ -439,10 +928,9 @@ def process_audio_files(files_to_merge, merged_output_name, output_filename, out
         # 首先计算总时长以便后续进度报告
         for idx, file_info in enumerate(files_to_merge):
             # 检查是否已取消处理
-            if processing_tasks.get(request_id, {}).get('cancelled', False):
+            if is_cancelled(request_id):
                 logger.info(f"处理任务 {request_id} 已被取消")
-                if request_id in processing_tasks:
-                    processing_tasks[request_id]['status'] = 'cancelled'
+                task_store.update(request_id, status='cancelled')
                 return
 
             try:
@@ -451,16 +939,15 @@ def process_audio_files(files_to_merge, merged_output_name, output_filename, out
             except Exception as e:
                 error_msg = f"处理文件 {file_info['displayName']} 时出错: {str(e)}"
                 logger.error(error_msg)
-                processing_tasks[request_id]['status'] = 'failed'
+                task_store.update(request_id, status='failed', stage='failed', message=error_msg)
                 return
 
         # 执行合并
         for idx, file_info in enumerate(files_to_merge):
             # 检查是否已取消处理
-            if processing_tasks.get(request_id, {}).get('cancelled', False):
+            if is_cancelled(request_id):
                 logger.info(f"处理任务 {request_id} 已被取消")
-                if request_id in processing_tasks:
-                    processing_tasks[request_id]['status'] = 'cancelled'
+                task_store.update(request_id, status='cancelled')
                 return
 
             try:
@@ -482,25 +969,26 @@ def process_audio_files(files_to_merge, merged_output_name, output_filename, out
                 logger.info(f"合并进度: {progress:.2f}%")
 
                 # 更新进度
-                if request_id in processing_tasks:
-                    processing_tasks[request_id]['progress'] = int((idx + 1) / len(files_to_merge) * 60)  # 0-60%
-                    processing_tasks[request_id]['stage'] = f"merging {file_info['displayName']}"
-                    processing_tasks[request_id]['message'] = f"正在合并: {file_info['displayName']}"
-                    processing_tasks[request_id]['currentFileIndex'] = idx + 1
-                    processing_tasks[request_id]['totalFilesCount'] = len(files_to_merge)
+                task_store.update(
+                    request_id,
+                    progress=int((idx + 1) / len(files_to_merge) * 60),  # 0-60%
+                    stage=f"merging {file_info['displayName']}",
+                    message=f"正在合并: {file_info['displayName']}",
+                    currentFileIndex=idx + 1,
+                    totalFilesCount=len(files_to_merge)
+                )
 
             except Exception as e:
                 error_msg = f"合并文件 {file_info['displayName']} 时出错: {str(e)}"
                 logger.error(error_msg)
 
-                processing_tasks[request_id]['status'] = 'failed'
+                task_store.update(request_id, status='failed', stage='failed', message=error_msg)
                 return
 
         # 检查是否已取消处理
-        if processing_tasks.get(request_id, {}).get('cancelled', False):
+        if is_cancelled(request_id):
             logger.info(f"处理任务 {request_id} 已被取消")
-            if request_id in processing_tasks:
-                processing_tasks[request_id]['status'] = 'cancelled'
+            task_store.update(request_id, status='cancelled')
 
             return
 
@@ -519,12 +1007,14 @@ def process_audio_files(files_to_merge, merged_output_name, output_filename, out
                 logger.info(f"调整后的音量级别: {final_dBFS:.2f} dBFS")
 
                 # 音量标准化阶段
-                if request_id in processing_tasks:
-                    processing_tasks[request_id]['progress'] = 70
-                    processing_tasks[request_id]['stage'] = "normalizing"
-                    processing_tasks[request_id]['message'] = "正在进行音量标准化..."
-                    processing_tasks[request_id]['currentFileIndex'] = len(files_to_merge)
-                    processing_tasks[request_id]['totalFilesCount'] = len(files_to_merge)
+                task_store.update(
+                    request_id,
+                    progress=70,
+                    stage="normalizing",
+                    message="正在进行音量标准化...",
+                    currentFileIndex=len(files_to_merge),
+                    totalFilesCount=len(files_to_merge)
+                )
             except Exception as e:
                 error_msg = f"音量调整失败: {str(e)}"
                 logger.error(error_msg)
@@ -544,33 +1034,34 @@ def process_audio_files(files_to_merge, merged_output_name, output_filename, out
             'merged': True,
             'mergedFrom': [f['id'] for f in files_to_merge],
             'normalizeVolume': normalize_volume,  # 是否已应用音量调整
-            'normalizeTargetDb': normalize_target_db if normalize_volume else None  # 应用的增益调整值
+            'normalizeTargetDb': normalize_target_db if normalize_volume else None,  # 应用的增益调整值
+            'renderKey': render_key  # 渲染缓存键，相同请求可直接复用该结果
         }
 
-        # 加载最新的元数据
-        metadata = load_metadata()
+        with metadata_lock:
+            # 加载最新的元数据
+            metadata = load_metadata()
 
-        # 将合并后的音频文件元数据添加到总元数据列表中
-        metadata.append(merged_file_info)
+            # 将合并后的音频文件元数据添加到总元数据列表中
+            metadata.append(merged_file_info)
 
-        # 保存更新后的元数据
-        save_metadata(metadata)
+            # 保存更新后的元数据
+            save_metadata(metadata)
 
         # 更新处理状态
-        if request_id in processing_tasks:
-            processing_tasks[request_id]['status'] = 'completed'
-            processing_tasks[request_id]['fileInfo'] = merged_file_info
+        task_store.update(
+            request_id,
+            status='completed',
+            fileInfo=merged_file_info,
+            progress=100,
+            stage="completed",
+            message="处理完成",
+            currentFileIndex=len(files_to_merge),
+            totalFilesCount=len(files_to_merge)
+        )
 
         logger.info(f"音频处理任务 {request_id} 已完成")
 
-        # 完成
-        if request_id in processing_tasks:
-            processing_tasks[request_id]['progress'] = 100
-            processing_tasks[request_id]['stage'] = "completed"
-            processing_tasks[request_id]['message'] = "处理完成"
-            processing_tasks[request_id]['currentFileIndex'] = len(files_to_merge)
-            processing_tasks[request_id]['totalFilesCount'] = len(files_to_merge)
-
     except Exception as e:
         error_msg = f"合并音频文件时出错: {str(e)}"
         logger.error(error_msg)
@@ -582,56 +1073,60 @@ def process_audio_files(files_to_merge, merged_output_name, output_filename, out
                 logger.error(f"清理临时文件失败: {cleanup_error}")
 
         # 更新处理状态
-        if request_id in processing_tasks:
-            processing_tasks[request_id]['status'] = 'failed'
-            processing_tasks[request_id]['progress'] = 0
-            processing_tasks[request_id]['stage'] = "failed"
-            processing_tasks[request_id]['message'] = str(e)
-            # 失败时也记录总文件数（如果有的话）
-            if 'totalFilesCount' in processing_tasks[request_id]:
-                processing_tasks[request_id]['currentFileIndex'] = processing_tasks[request_id][
-                    'totalFilesCount']  # 将当前文件数设为总数
-            else:
-                processing_tasks[request_id]['currentFileIndex'] = 0
-                processing_tasks[request_id]['totalFilesCount'] = 0
+        task = task_store.get(request_id) or {}
+        # 失败时也记录总文件数（如果有的话），并将当前文件数设为总数
+        total_files_count = task.get('totalFilesCount', 0)
+        task_store.update(
+            request_id,
+            status='failed',
+            progress=0,
+            stage="failed",
+            message=str(e),
+            currentFileIndex=total_files_count,
+            totalFilesCount=total_files_count
+        )
 
         logger.error(f"音频处理任务 {request_id} 失败: {error_msg}")
 
 
 # POST /api/cancel-processing: 取消处理任务
 @app.post("/api/cancel-processing")
-async def cancel_processing(request: dict):
+def cancel_processing(request: dict):
     request_id = request.get('requestId')
     if not request_id:
         raise HTTPException(status_code=400, detail="未提供处理任务ID")
 
-    if request_id not in processing_tasks:
+    # 标记任务为已取消
+    task = task_store.update(request_id, cancelled=True, status='cancelled')
+    if task is None:
         raise HTTPException(status_code=404, detail="找不到指定的处理任务")
 
-    # 标记任务为已取消
-    processing_tasks[request_id]['cancelled'] = True
-    processing_tasks[request_id]['status'] = 'cancelled'
+    if 'jobId' in task:
+        cancel_render_subscriber(request_id, task['jobId'])
 
     return {"success": True, "message": "处理任务已标记为取消"}
 
 
 # POST /api/check-processing-status: 检查处理任务状态
 @app.post("/api/check-processing-status")
-async def check_processing_status(request: dict):
+def check_processing_status(request: dict):
     request_id = request.get('requestId')
     if not request_id:
         raise HTTPException(status_code=400, detail="未提供处理任务ID")
 
-    if request_id not in processing_tasks:
+    task = resolve_task(request_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="找不到指定的处理任务")
 
-    # 获取当前任务状态
-    task_status = processing_tasks[request_id].get('status', 'processing')
-    progress = processing_tasks[request_id].get('progress', 0)
-    stage = processing_tasks[request_id].get('stage', '')
-    message = processing_tasks[request_id].get('message', '')
-    current_file_index = processing_tasks[request_id].get('currentFileIndex', 0)
-    total_files_count = processing_tasks[request_id].get('totalFilesCount', 0)
+    # 获取当前任务状态；排队中的任务对前端显示为处理中
+    task_status = task.get('status', 'processing')
+    if task_status == 'queued':
+        task_status = 'processing'
+    progress = task.get('progress', 0)
+    stage = task.get('stage', '')
+    message = task.get('message', '')
+    current_file_index = task.get('currentFileIndex', 0)
+    total_files_count = task.get('totalFilesCount', 0)
 
     # 构建响应数据
     response_data = {
@@ -645,8 +1140,8 @@ async def check_processing_status(request: dict):
     }
 
     # 如果任务已完成且有关联的文件信息，添加到响应中
-    if task_status == 'completed' and 'fileInfo' in processing_tasks[request_id]:
-        response_data['fileInfo'] = processing_tasks[request_id]['fileInfo']
+    if task_status == 'completed' and 'fileInfo' in task:
+        response_data['fileInfo'] = task['fileInfo']
 
     logger.info(
         f"检查处理状态: 请求ID={request_id}, 状态={task_status}, 进度={progress}, 阶段={stage}, "
@@ -671,6 +1166,7 @@ def download_audio(audio_id: str):
                 if item.get('merged', False) and not display_name.lower().endswith('.mp3'):
                     display_name = f"{display_name}.mp3"
 
+                touch_metadata([audio_id])
                 logger.info(f"下载文件: {item['path']} (显示为 {display_name})")
                 return FileResponse(
                     path=item['path'],
@@ -696,22 +1192,23 @@ def reorder_audio(request: ReorderRequest):
         raise HTTPException(status_code=400, detail="未提供新的顺序")
 
     try:
-        metadata = load_metadata()
-        id_to_item = {item['id']: item for item in metadata}
-
-        current_unmerged_ids = {item['id'] for item in metadata if not item.get('merged', False)}
-        if set(new_order_ids) != current_unmerged_ids:
-            logger.warning("提供的顺序列表与当前未处理文件列表不匹配")
-            raise HTTPException(status_code=400, detail="提供的顺序列表与当前未处理文件列表不匹配")
-
-        for i, audio_id in enumerate(new_order_ids):
-            if audio_id in id_to_item:
-                if not id_to_item[audio_id].get('merged', False):
-                    id_to_item[audio_id]['order'] = i + 1
-            else:
-                logger.warning(f"在重新排序时找不到ID: {audio_id}")
+        with metadata_lock:
+            metadata = load_metadata()
+            id_to_item = {item['id']: item for item in metadata}
+
+            current_unmerged_ids = {item['id'] for item in metadata if not item.get('merged', False)}
+            if set(new_order_ids) != current_unmerged_ids:
+                logger.warning("提供的顺序列表与当前未处理文件列表不匹配")
+                raise HTTPException(status_code=400, detail="提供的顺序列表与当前未处理文件列表不匹配")
+
+            for i, audio_id in enumerate(new_order_ids):
+                if audio_id in id_to_item:
+                    if not id_to_item[audio_id].get('merged', False):
+                        id_to_item[audio_id]['order'] = (i + 1) * ORDER_STEP
+                else:
+                    logger.warning(f"在重新排序时找不到ID: {audio_id}")
 
-        save_metadata(metadata)
+            save_metadata(metadata)
         updated_unmerged_files = [item for item in metadata if not item.get('merged', False)]
         updated_unmerged_files.sort(key=lambda x: x.get('order', 0))
         logger.info(f"已重新排序 {len(updated_unmerged_files)} 个文件")
@@ -721,6 +1218,248 @@ def reorder_audio(request: ReorderRequest):
         raise HTTPException(status_code=500, detail=f"重新排序时出错: {str(e)}")
 
 
+# POST /api/audio/{audio_id}/move: 将单个未合并音频移动到指定文件之前（或末尾）
+# 只改写被移动文件的排序键，多人同时拖动不同文件时不会互相覆盖
+@app.post("/api/audio/{audio_id}/move")
+def move_audio(audio_id: str, request: MoveRequest):
+    if request.beforeId == audio_id:
+        raise HTTPException(status_code=400, detail="不能将文件移动到自身之前")
+
+    with metadata_lock:
+        metadata = load_metadata()
+        unmerged = [item for item in metadata if not item.get('merged', False)]
+        unmerged.sort(key=lambda x: x.get('order', 0))
+
+        item_to_move = next((item for item in unmerged if item['id'] == audio_id), None)
+        if not item_to_move:
+            raise HTTPException(status_code=404, detail="未找到未处理的音频文件")
+
+        others = [item for item in unmerged if item is not item_to_move]
+        if request.beforeId is None:
+            insert_index = len(others)
+        else:
+            insert_index = next((i for i, item in enumerate(others) if item['id'] == request.beforeId), None)
+            if insert_index is None:
+                raise HTTPException(status_code=404, detail=f"未找到ID为 {request.beforeId} 的待处理音频文件")
+
+        lower = others[insert_index - 1].get('order', 0) if insert_index > 0 else 0
+        if insert_index < len(others):
+            upper = others[insert_index].get('order', 0)
+        else:
+            upper = lower + 2 * ORDER_STEP
+
+        rebalanced = False
+        if upper - lower >= 2:
+            item_to_move['order'] = (lower + upper) // 2
+        else:
+            # 相邻排序键之间已无空位，按目标顺序整体重排一次
+            others.insert(insert_index, item_to_move)
+            rebalance_order(others)
+            rebalanced = True
+            logger.info(f"排序键间隔耗尽，已重排 {len(others)} 个文件")
+
+        save_metadata(metadata)
+
+    target = f"{request.beforeId} 之前" if request.beforeId else "末尾"
+    logger.info(f"已移动文件 {audio_id} 到 {target}，新排序键: {item_to_move['order']}")
+    return {"item": item_to_move, "rebalanced": rebalanced}
+
+
+# --- 定时渲染 ---
+# 按计划任务的播放列表查找待合并文件并提交渲染，供调度器调用
+def submit_scheduled_render(job, output_name):
+    metadata = load_metadata()
+    unmerged = {item['id']: item for item in metadata if not item.get('merged', False)}
+    check_playlist(job['audioIds'], unmerged)
+
+    # 计划任务按播放列表中的顺序合并
+    files_to_merge = [unmerged[audio_id] for audio_id in job['audioIds']]
+    request_id = str(uuid.uuid4())
+    submit_merge(files_to_merge, output_name, request_id,
+                 job.get('normalizeVolume', False), job.get('normalizeTargetDb', -3.0),
+                 client='scheduler', priority=True)
+    return request_id
+
+
+# 检查播放列表中的音频是否都是现有的待合并文件，不存在时抛出 ValueError
+def check_playlist(audio_ids, unmerged=None):
+    if unmerged is None:
+        unmerged = {item['id'] for item in load_metadata() if not item.get('merged', False)}
+    missing = [audio_id for audio_id in audio_ids if audio_id not in unmerged]
+    if missing:
+        raise ValueError(f"播放列表中的音频文件不存在: {', '.join(missing)}")
+
+
+# 计算播放列表中音频的总时长（秒），用于估算渲染耗时
+def playlist_seconds(audio_ids):
+    durations = {item['id']: item.get('duration', 0) for item in load_metadata()}
+    return sum(durations.get(audio_id, 0) for audio_id in audio_ids)
+
+
+render_scheduler = RenderScheduler(
+    SCHEDULE_FILE,
+    submit_scheduled_render,
+    resolve_task,
+    source_seconds=playlist_seconds,
+    poll_interval=int(os.getenv("SCHEDULER_POLL_SECONDS", "30")),
+    peak_hours=parse_peak_hours(os.getenv("SCHEDULER_PEAK_HOURS", "")),
+    lead_margin=int(os.getenv("SCHEDULER_LEAD_SECONDS", "300")),
+)
+
+
+# GET /api/schedules: 获取所有定时渲染计划任务
+@app.get("/api/schedules")
+def get_schedules():
+    return render_scheduler.list_all()
+
+
+# POST /api/schedules: 创建定时渲染计划任务
+@app.post("/api/schedules", status_code=201)
+def create_schedule(request: ScheduleRequest):
+    try:
+        check_playlist(request.audioIds)
+        return render_scheduler.create(request.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# PUT /api/schedules/{schedule_id}: 更新定时渲染计划任务
+@app.put("/api/schedules/{schedule_id}")
+def update_schedule(schedule_id: str, data: ScheduleUpdate):
+    fields = {key: value for key, value in data.dict().items() if value is not None}
+    try:
+        if 'audioIds' in fields:
+            check_playlist(fields['audioIds'])
+        schedule = render_scheduler.update(schedule_id, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if schedule is None:
+        raise HTTPException(status_code=404, detail="未找到计划任务")
+    return schedule
+
+
+# DELETE /api/schedules/{schedule_id}: 删除定时渲染计划任务（已生成的输出保留）
+@app.delete("/api/schedules/{schedule_id}")
+def delete_schedule(schedule_id: str):
+    if not render_scheduler.delete(schedule_id):
+        raise HTTPException(status_code=404, detail="未找到计划任务")
+    return {"success": True, "message": f"计划任务 {schedule_id} 已删除"}
+
+
+# POST /api/schedules/{schedule_id}/run: 立即执行一次计划任务的渲染
+@app.post("/api/schedules/{schedule_id}/run")
+def run_schedule(schedule_id: str):
+    if not any(job['id'] == schedule_id for job in render_scheduler.load()):
+        raise HTTPException(status_code=404, detail="未找到计划任务")
+    request_id = render_scheduler.run_now(schedule_id)
+    if request_id is None:
+        raise HTTPException(status_code=400, detail="提交渲染失败，请检查播放列表中的音频文件")
+    return {"id": request_id, "status": "processing", "message": "计划任务渲染已提交到后台执行"}
+
+
+# --- 存储保留 ---
+# 存储清理不可删除的文件：置顶的输出、计划任务的播放列表和最近一次成功输出、正在合并的文件
+def retention_protected_ids():
+    protected = {item['id'] for item in load_metadata() if item.get('pinned')}
+    for job in render_scheduler.load():
+        protected.update(job.get('audioIds') or [])
+        if job.get('lastResultId'):
+            protected.add(job['lastResultId'])
+    for task in task_store.active_jobs().values():
+        protected.update(task.get('audioIds') or [])
+    return protected
+
+
+retention_manager = RetentionManager(
+    [
+        RetentionPolicy('uploads', UPLOAD_FOLDER,
+                        max_bytes=int(env_number("UPLOADS_QUOTA_MB") * MB),
+                        max_age_days=env_number("UPLOADS_MAX_AGE_DAYS")),
+        RetentionPolicy('processed', PROCESSED_FOLDER,
+                        max_bytes=int(env_number("PROCESSED_QUOTA_MB") * MB),
+                        max_age_days=env_number("PROCESSED_MAX_AGE_DAYS")),
+        RetentionPolicy('logs', LOGS_FOLDER,
+                        max_bytes=int(env_number("LOGS_QUOTA_MB", 200) * MB),
+                        max_age_days=env_number("LOGS_MAX_AGE_DAYS", 7),
+                        keep_files=['app.log']),
+    ],
+    metadata_lock,
+    load_metadata,
+    save_metadata,
+    protected_ids=retention_protected_ids,
+    interval=int(env_number("RETENTION_INTERVAL_SECONDS", 600)),
+    orphan_grace=int(env_number("RETENTION_ORPHAN_GRACE_SECONDS", 3600)),
+    state_file=os.path.join(TASKS_FOLDER, '.retention.json'),
+)
+
+
+# --- 后台服务 ---
+# 合并调度、定时渲染和存储清理只在一个进程中运行：
+# 开发模式（MERGE_WORKER=embedded）下随 API 进程启动，生产模式下由 worker.py 启动
+def start_background_services():
+    merge_stop.clear()
+    threading.Thread(target=merge_dispatcher_loop, name="merge-dispatcher", daemon=True).start()
+    render_scheduler.start()
+    retention_manager.start()
+    logger.info(f"后台服务已启动 (进程ID: {os.getpid()}, 合并并发数: {MERGE_CONCURRENCY})")
+
+
+def stop_background_services():
+    merge_stop.set()
+    merge_wakeup.set()
+    render_scheduler.stop()
+    retention_manager.stop()
+
+
+@app.on_event("startup")
+def start_embedded_services():
+    # 在后台预先加载元数据，不阻塞启动；第一个列表请求可以直接使用缓存
+    threading.Thread(target=load_metadata, name="metadata-warmup", daemon=True).start()
+    if MERGE_WORKER_MODE == 'embedded':
+        start_background_services()
+
+
+@app.on_event("shutdown")
+def stop_embedded_services():
+    if MERGE_WORKER_MODE == 'embedded':
+        stop_background_services()
+
+
+# GET /api/storage: 获取最近一次清理结果及清理后各目录的存储占用（不在请求中重新扫描目录）
+@app.get("/api/storage")
+def get_storage():
+    report = retention_manager.last_report
+    return {"usage": report.get('usage') if report else None, "lastReport": report}
+
+
+# POST /api/storage/cleanup: 立即在后台执行一次存储清理
+@app.post("/api/storage/cleanup", status_code=202)
+def cleanup_storage():
+    retention_manager.trigger()
+    return {"success": True, "message": "存储清理已在后台开始执行"}
+
+
+# GET /api/admission: 获取当前的上传和合并队列负载
+@app.get("/api/admission")
+def get_admission():
+    jobs = task_store.active_jobs().values()
+    return {
+        "uploads": ingest_limiter.snapshot(),
+        "merges": {
+            "queued": sum(1 for task in jobs if task.get('status') == 'queued'),
+            "processing": sum(1 for task in jobs if task.get('status') == 'processing'),
+            "maxQueued": MERGE_QUEUE_MAX,
+            "maxPerClient": MERGE_QUEUE_PER_CLIENT,
+        },
+    }
+
+
+# GET /api/health: 健康检查，不读取磁盘，也不占用线程池，进程能处理请求即返回
+@app.get("/api/health")
+async def health_check():
+    return {"status": "ok", "pid": os.getpid(), "metadataLoaded": metadata_cache['key'] is not None}
+
+
 # 添加根路径的API文档重定向
 @app.get("/")
 def read_root():
@@ -0,0 +1,162 @@
+import argparse
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 本地负载测试：分别以不同的 API worker 数启动生产模式，测量上传和列表接口的吞吐量。
+# 每轮使用独立的临时数据目录，不会影响 uploads/ 和 audio_metadata.json。
+# 用法: python loadtest.py --workers 1 2 4 --requests 300 --concurrency 16
+
+
+def wait_until_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/", timeout=1):
+                return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    return False
+
+
+def upload_once(base_url, payload_size):
+    # 每次上传内容不同的文件，避免被查重跳过
+    boundary = uuid.uuid4().hex
+    content = uuid.uuid4().bytes * (payload_size // 16 + 1)
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="files"; filename="{uuid.uuid4().hex}.wav"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode("utf-8") + content[:payload_size] + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    request = urllib.request.Request(
+        f"{base_url}/api/upload", data=body, method="POST",
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+
+
+def list_once(base_url, _payload_size):
+    with urllib.request.urlopen(f"{base_url}/api/audio", timeout=60) as response:
+        response.read()
+
+
+def run_phase(func, base_url, total, concurrency, payload_size):
+    latencies = []
+    rejected = 0
+    errors = 0
+
+    def timed(_):
+        started = time.perf_counter()
+        func(base_url, payload_size)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed, i) for i in range(total)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except urllib.error.HTTPError as e:
+                if e.code == 429:
+                    rejected += 1
+                else:
+                    errors += 1
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed if elapsed else 0,
+        "p50": statistics.median(latencies) * 1000 if latencies else 0,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0,
+        "rejected": rejected,
+        "errors": errors,
+    }
+
+
+def start_server(workers, port, data_dir):
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    # 关闭上传准入限制：所有测试客户端都来自 127.0.0.1，否则大部分上传会被以 429 拒绝
+    env = dict(os.environ, DATA_DIR=data_dir, UPLOAD_MAX_CONCURRENT="0",
+               UPLOAD_MAX_CONCURRENT_PER_CLIENT="0", UPLOAD_MAX_INFLIGHT_MB="0")
+    kwargs = {"start_new_session": True} if os.name == "posix" else {}
+    return subprocess.Popen(
+        [sys.executable, os.path.join(backend_dir, "run.py"), "--production",
+         "--workers", str(workers), "--port", str(port)],
+        cwd=backend_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+
+def stop_server(process):
+    if os.name == "posix":
+        os.killpg(process.pid, signal.SIGINT)
+    else:
+        process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上传和列表接口吞吐量负载测试")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="依次测试的 API worker 数")
+    parser.add_argument("--requests", type=int, default=300, help="每个阶段的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发客户端数")
+    parser.add_argument("--payload-kb", type=int, default=256, help="每个上传文件的大小（KB）")
+    parser.add_argument("--port", type=int, default=8100, help="测试服务器端口")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    failed = False
+    for workers in args.workers:
+        data_dir = tempfile.mkdtemp(prefix="radio-loadtest-")
+        process = start_server(workers, args.port, data_dir)
+        try:
+            if not wait_until_ready(base_url):
+                print(f"workers={workers}: 服务器启动超时")
+                failed = True
+                continue
+            upload = run_phase(upload_once, base_url, args.requests, args.concurrency, args.payload_kb * 1024)
+            listing = run_phase(list_once, base_url, args.requests, args.concurrency, 0)
+            results.append((workers, upload, listing))
+            print(f"workers={workers}: 上传 {upload['rps']:.1f} req/s, 列表 {listing['rps']:.1f} req/s")
+        finally:
+            stop_server(process)
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"\n{'workers':>7} | {'upload req/s':>12} | {'p50 ms':>7} | {'p95 ms':>7} | {'list req/s':>10} | "
+          f"{'p50 ms':>7} | {'p95 ms':>7} | {'429':>5} | errors")
+    for workers, upload, listing in results:
+        print(f"{workers:>7} | {upload['rps']:>12.1f} | {upload['p50']:>7.1f} | {upload['p95']:>7.1f} | "
+              f"{listing['rps']:>10.1f} | {listing['p50']:>7.1f} | {listing['p95']:>7.1f} | "
+              f"{upload['rejected'] + listing['rejected']:>5} | {upload['errors'] + listing['errors']}")
+    if len(results) > 1:
+        base_upload, base_list = results[0][1]['rps'], results[0][2]['rps']
+        for workers, upload, listing in results[1:]:
+            print(f"workers={workers} 相对 workers={results[0][0]}: 上传 x{upload['rps'] / base_upload:.2f}, "
+                  f"列表 x{listing['rps'] / base_list:.2f}")
+
+    # 吞吐量只统计成功的请求，有请求失败或被拒绝时结果不可比较
+    if failed or any(phase['rejected'] or phase['errors'] for _, upload, listing in results
+                     for phase in (upload, listing)):
+        print("\n存在失败或被拒绝（429）的请求，测试结果无效")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+
+from shared_state import atomic_write_json
+
+MB = 1024 * 1024
+DAY = 24 * 60 * 60
+
+
+class RetentionPolicy:
+    """单个目录的保留策略。
+
+    kind 为 'uploads'、'processed' 或 'logs'；max_bytes 和 max_age_days 为 0 时
+    表示不限制。uploads 和 processed 目录中的文件与元数据一一对应，logs 目录
+    只按文件修改时间处理，且不会删除正在写入的日志文件。
+    """
+
+    def __init__(self, kind, folder, max_bytes=0, max_age_days=0, keep_files=()):
+        self.kind = kind
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.keep_files = set(keep_files)
+
+
+class RetentionManager:
+    """后台存储保留管理器：按目录配额、过期时间和 LRU 策略清理文件，并检测孤立文件。
+
+    目录使用 os.scandir 分批扫描，每批之间短暂让出 CPU；只有在修改元数据时才会
+    短暂持有 metadata_lock，因此不会阻塞 API 请求。protected_ids 回调返回不可删除
+    的元数据ID集合（置顶的输出、计划任务使用的文件、正在合并的文件等）。
+
+    设置 state_file 后，最近一次清理结果会写入该文件，其他进程（如多个 API worker）
+    可以读取结果，并通过触发文件请求运行清理的进程立即执行一次清理。
+    """
+
+    def __init__(self, policies, metadata_lock, load_metadata, save_metadata, protected_ids=None,
+                 interval=600, batch_size=200, batch_pause=0.05, orphan_grace=3600, state_file=None):
+        self.policies = policies
+        self.metadata_lock = metadata_lock
+        self.load_metadata = load_metadata
+        self.save_metadata = save_metadata
+        self.protected_ids = protected_ids
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.orphan_grace = orphan_grace
+        self.state_file = state_file
+        self.trigger_file = state_file + '.trigger' if state_file else None
+        self._last_report = None
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def last_report(self):
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, Exception) as e:
+                logger.error(f"读取存储清理结果时出错: {e}")
+        return self._last_report
+
+    # --- 目录扫描 ---
+    def scan(self, folder):
+        # 分批扫描目录中的普通文件，返回 {文件名: (大小, 修改时间)}
+        files = {}
+        if not os.path.isdir(folder):
+            return files
+        with os.scandir(folder) as entries:
+            for count, entry in enumerate(entries, 1):
+                if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue  # 扫描期间被删除
+                files[entry.name] = (stat.st_size, stat.st_mtime)
+                if count % self.batch_size == 0:
+                    if self._stop_event.is_set():
+                        break
+                    time.sleep(self.batch_pause)
+        return files
+
+    @staticmethod
+    def _usage(policy, sizes):
+        # 清理后目录占用的空间，记录在清理结果中，查询时不再重新扫描目录
+        return {
+            'files': len(sizes),
+            'bytes': sum(sizes.values()),
+            'maxBytes': policy.max_bytes,
+            'maxAgeDays': policy.max_age_days,
+        }
+
+    # --- 清理 ---
+    def run_once(self):
+        started = time.time()
+        report = {'startedAt': started, 'folders': {}, 'usage': {}}
+        for policy in self.policies:
+            try:
+                if policy.kind == 'logs':
+                    result, sizes = self._apply_logs(policy)
+                else:
+                    result, sizes = self._apply_metadata_folder(policy)
+                report['folders'][policy.kind] = result
+                report['usage'][policy.kind] = self._usage(policy, sizes)
+            except Exception as e:
+                logger.error(f"清理目录 {policy.folder} 时出错: {e}")
+                report['folders'][policy.kind] = {'error': str(e)}
+        report['seconds'] = round(time.time() - started, 3)
+        self._last_report = report
+        if self.state_file:
+            try:
+                atomic_write_json(self.state_file, report)
+            except Exception as e:
+                logger.error(f"保存存储清理结果时出错: {e}")
+        return report
+
+    def _apply_metadata_folder(self, policy):
+        now = time.time()
+        merged = policy.kind == 'processed'
+        files = self.scan(policy.folder)
+
+        metadata = self.load_metadata()
+        # 命中渲染缓存时多条记录可能指向同一文件，按文件分组处理
+        by_name = {}
+        for item in metadata:
+            if bool(item.get('merged', False)) == merged:
+                by_name.setdefault(os.path.basename(item['path']), []).append(item)
+        protected = set(self.protected_ids()) if self.protected_ids else set()
+
+        # 磁盘上存在但没有元数据的文件；留出宽限期，避免误删正在上传或导出的文件
+        orphan_files = [name for name, (_, mtime) in files.items()
+                        if name not in by_name and now - mtime > self.orphan_grace]
+        # 有元数据但文件已不存在的记录
+        orphan_ids = {item['id'] for name, group in by_name.items() if name not in files for item in group}
+
+        # 按最近使用时间从旧到新排列可删除的文件（LRU）；任一记录受保护时整个文件受保护
+        def last_used(name):
+            return max([files[name][1]] + [item.get('lastAccessedAt') or 0 for item in by_name[name]])
+
+        candidates = sorted((name for name, group in by_name.items()
+                             if name in files and not any(item['id'] in protected for item in group)),
+                            key=last_used)
+
+        expired = set()
+        if policy.max_age_days:
+            cutoff = now - policy.max_age_days * DAY
+            expired = {name for name in candidates if last_used(name) < cutoff}
+
+        evicted = set()
+        if policy.max_bytes:
+            total = sum(size for name, (size, _) in files.items() if name not in orphan_files)
+            total -= sum(files[name][0] for name in expired)
+            for name in candidates:
+                if total <= policy.max_bytes:
+                    break
+                if name in expired:
+                    continue
+                evicted.add(name)
+                total -= files[name][0]
+            if total > policy.max_bytes:
+                logger.warning(f"{policy.kind} 目录超出配额，但剩余文件均受保护")
+
+        for name in orphan_files:
+            self._remove_file(os.path.join(policy.folder, name))
+
+        removed_ids = {item['id'] for name in expired | evicted for item in by_name[name]}
+        removed = self._remove_items(orphan_ids | removed_ids, orphan_ids)
+        if orphan_files or removed:
+            logger.info(f"{policy.kind} 目录清理: 孤立文件 {len(orphan_files)} 个, 孤立记录 {len(orphan_ids)} 条, "
+                        f"过期 {len(expired)} 个, 超出配额 {len(evicted)} 个")
+
+        # 清理后剩余文件的大小
+        sizes = {name: size for name, (size, _) in files.items() if name not in orphan_files}
+        for item in removed:
+            if not os.path.exists(item['path']):
+                sizes.pop(os.path.basename(item['path']), None)
+        return {
+            'orphanFiles': len(orphan_files),
+            'orphanRecords': len(orphan_ids),
+            'expired': len(expired),
+            'evicted': len(evicted),
+        }, sizes
+
+    def _remove_items(self, ids, missing_ids):
+        if not ids:
+            return []
+        with self.metadata_lock:
+            metadata = self.load_metadata()
+            # 扫描期间可能有文件被置顶或开始合并，加锁后重新获取受保护的ID
+            protected = set(self.protected_ids()) if self.protected_ids else set()
+            removed = []
+            for item in metadata:
+                if item['id'] not in ids or (item['id'] in protected and item['id'] not in missing_ids):
+                    continue
+                # 孤立记录在加锁后再确认一次，文件可能刚刚被写入
+                if item['id'] in missing_ids and os.path.exists(item['path']):
+                    continue
+                removed.append(item)
+            removed_ids = {item['id'] for item in removed}
+            remaining = [item for item in metadata if item['id'] not in removed_ids]
+            self.save_metadata(remaining)
+            # 仍被其他记录引用的文件不删除
+            in_use = {item['path'] for item in remaining}
+
+        for item in removed:
+            if item['id'] not in missing_ids and item['path'] not in in_use:
+                self._remove_file(item['path'])
+        return removed
+
+    def _apply_logs(self, policy):
+        now = time.time()
+        files = self.scan(policy.folder)
+        # 正在写入的日志文件不参与清理，其余（已轮转的）日志从旧到新排列
+        candidates = sorted((name for name in files if name not in policy.keep_files),
+                            key=lambda name: files[name][1])
+
+        removed = []
+        if policy.max_age_days:
+            cutoff = now - policy.max_age_days * DAY
+            removed = [name for name in candidates if files[name][1] < cutoff]
+        if policy.max_bytes:
+            total = sum(size for name, (size, _) in files.items() if name not in removed)
+            for name in candidates:
+                if total <= policy.max_bytes:
+                    break
+                if name not in removed:
+                    removed.append(name)
+                    total -= files[name][0]
+
+        for name in removed:
+            self._remove_file(os.path.join(policy.folder, name))
+        if removed:
+            logger.info(f"日志目录清理: 删除 {len(removed)} 个旧日志文件")
+        sizes = {name: size for name, (size, _) in files.items() if name not in removed}
+        return {'removed': len(removed)}, sizes
+
+    def _remove_file(self, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info(f"存储清理已删除文件: {path}")
+        except Exception as e:
+            logger.error(f"存储清理删除文件 {path} 时出错: {e}")
+
+    # --- 后台线程 ---
+    def trigger(self):
+        # 立即唤醒后台线程执行一次清理；后台线程可能在其他进程中，同时写入触发文件
+        self._wake_event.set()
+        if self.trigger_file:
+            with open(self.trigger_file, 'w', encoding='utf-8'):
+                pass
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="retention-manager", daemon=True)
+        self._thread.start()
+        logger.info(f"存储保留管理器已启动，清理间隔 {self.interval} 秒")
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"存储清理时出错: {e}")
+            self._wait_next_run()
+
+    def _wait_next_run(self):
+        # 等待清理间隔结束、被唤醒或发现触发文件
+        deadline = time.time() + self.interval
+        while not self._stop_event.is_set() and time.time() < deadline:
+            if self._wake_event.wait(min(5, max(deadline - time.time(), 0))):
+                break
+            if self.trigger_file and os.path.exists(self.trigger_file):
+                break
+        self._wake_event.clear()
+        if self.trigger_file:
+            try:
+                os.remove(self.trigger_file)
+            except FileNotFoundError:
+                pass
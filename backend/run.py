@@ -1,34 +1,39 @@
+import argparse
+import importlib.util
 import os
+import shutil
+import subprocess
 import sys
 from loguru import logger
 
 
+# 只检查依赖是否已安装，不实际导入，避免启动时重复加载 FastAPI 和 pydub
+REQUIRED_MODULES = {
+    "fastapi": "fastapi",
+    "uvicorn": "uvicorn",
+    "multipart": "python-multipart",
+    "pydub": "pydub",
+    "dotenv": "python-dotenv",
+    "loguru": "loguru",
+}
+
+
 def check_dependencies():
-    try:
-        from fastapi import FastAPI
-        from fastapi.middleware.cors import CORSMiddleware
-        from pydub import AudioSegment
-        import uvicorn
-        import loguru
-        logger.info("所有依赖已安装。")
-        return True
-    except ImportError as e:
-        logger.error(f"缺少依赖: {e}")
+    missing = [package for module, package in REQUIRED_MODULES.items() if importlib.util.find_spec(module) is None]
+    if missing:
+        logger.error(f"缺少依赖: {', '.join(missing)}")
         logger.error("请运行: pip install -r requirements.txt")
         return False
+    logger.info("所有依赖已安装。")
+    return True
 
 
 def check_ffmpeg():
-    try:
-        from pydub.utils import which
-        if which("ffmpeg") is None:
-            logger.warning("警告: 未检测到FFmpeg。音频处理功能可能无法正常工作。")
-            logger.warning("请安装FFmpeg: https://ffmpeg.org/download.html")
-            return False
-        return True
-    except Exception as e:
-        logger.error(f"检查FFmpeg时出错: {e}")
+    if shutil.which("ffmpeg") is None and shutil.which("avconv") is None:
+        logger.warning("警告: 未检测到FFmpeg。音频处理功能可能无法正常工作。")
+        logger.warning("请安装FFmpeg: https://ffmpeg.org/download.html")
         return False
+    return True
 
 
 def create_directories():
@@ -68,7 +73,26 @@ def setup_logger():
     )
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="校园广播站音频处理系统后端")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"), help="监听地址")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")), help="监听端口")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", "1")),
+                        help="API worker 进程数，大于 1 时自动使用生产模式")
+    parser.add_argument("--production", action="store_true",
+                        help="生产模式：关闭自动重载，合并任务由独立的合并 worker 进程执行")
+    return parser.parse_args()
+
+
+def start_merge_worker(current_dir):
+    # 合并任务、定时渲染和存储清理在独立进程中运行，API worker 只负责读写共享状态
+    logger.info("启动合并 worker 进程...")
+    return subprocess.Popen([sys.executable, os.path.join(current_dir, "worker.py")], cwd=current_dir)
+
+
 def run_app():
+    args = parse_args()
+
     # 设置日志
     setup_logger()
 
@@ -85,7 +109,24 @@ def run_app():
     os.chdir(current_dir)
     # 直接使用uvicorn模块启动，而不是通过os.system
     import uvicorn
-    uvicorn.run("app:app", host="127.0.0.1", port=8000, reload=True)
+
+    if not args.production and args.workers <= 1:
+        # 开发模式：单进程，代码修改后自动重载，合并任务在 API 进程内执行
+        uvicorn.run("app:app", host=args.host, port=args.port, reload=True)
+        return
+
+    # 生产模式：多个 API worker 共享磁盘上的元数据和任务状态，合并任务交给独立的合并 worker
+    os.environ["MERGE_WORKER"] = "external"
+    merge_worker = start_merge_worker(current_dir)
+    logger.info(f"生产模式: {args.workers} 个 API worker，监听 {args.host}:{args.port}")
+    try:
+        uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers, reload=False)
+    finally:
+        merge_worker.terminate()
+        try:
+            merge_worker.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            merge_worker.kill()
 
 
 if __name__ == "__main__":
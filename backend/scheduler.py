@@ -0,0 +1,332 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, time, timedelta
+
+from loguru import logger
+
+from shared_state import TERMINAL_STATUSES, FileLock, atomic_write_json
+
+# 每个计划任务保留的历史耗时记录条数
+HISTORY_LIMIT = 10
+# 同一个播出时间点最多尝试渲染的次数（首次 + 失败重试）
+MAX_ATTEMPTS = 2
+# 修改后需要按新设置重新渲染当前播出时间点的字段
+RENDER_FIELDS = ('time', 'weekdays', 'audioIds', 'outputName', 'normalizeVolume', 'normalizeTargetDb')
+
+
+def parse_clock(value):
+    # 解析 "HH:MM" 格式的时间，返回当天的分钟数
+    try:
+        hours, minutes = value.strip().split(':')
+        hours, minutes = int(hours), int(minutes)
+    except (AttributeError, ValueError):
+        raise ValueError(f"无效的时间格式: {value}，应为 HH:MM")
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"无效的时间: {value}")
+    return hours * 60 + minutes
+
+
+def parse_peak_hours(value):
+    # 解析高峰时段配置，例如 "07:00-08:30,11:30-13:30"
+    windows = []
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        start_min, end_min = parse_clock(start), parse_clock(end)
+        if end_min <= start_min:
+            raise ValueError(f"无效的高峰时段: {part}")
+        windows.append((start_min, end_min))
+    return windows
+
+
+class RenderScheduler:
+    """按固定播出时间提前渲染节目的计划任务调度器。
+
+    计划任务保存在本地 JSON 文件中，调度线程只依赖本地时钟。渲染通过
+    submit_render 回调提交到合并队列，回调返回请求ID；task_status 回调按请求ID
+    返回任务状态字典，调度线程据此记录渲染结果。计划任务文件由跨进程文件锁保护，
+    多个 API worker 可以同时修改，调度线程只在一个进程中运行。
+    """
+
+    def __init__(self, schedule_file, submit_render, task_status, source_seconds=None, poll_interval=30,
+                 peak_hours=None, safety_factor=1.5, lead_margin=300, default_estimate=300):
+        self.schedule_file = schedule_file
+        self.submit_render = submit_render
+        self.task_status = task_status
+        self.source_seconds = source_seconds
+        self.poll_interval = poll_interval
+        self.peak_hours = peak_hours or []
+        self.safety_factor = safety_factor
+        self.lead_margin = lead_margin
+        self.default_estimate = default_estimate
+        self.lock = FileLock(schedule_file + '.lock')
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # --- 计划任务存储 ---
+    def load(self):
+        if os.path.exists(self.schedule_file):
+            try:
+                with open(self.schedule_file, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                    return json.loads(content) if content else []
+            except (json.JSONDecodeError, Exception) as e:
+                logger.error(f"加载计划任务时出错: {e}")
+        return []
+
+    def save(self, schedules):
+        try:
+            atomic_write_json(self.schedule_file, schedules)
+        except Exception as e:
+            logger.error(f"保存计划任务时出错: {e}")
+
+    def list_all(self, now=None):
+        now = now or datetime.now()
+        with self.lock:
+            schedules = self.load()
+            return [self.describe(job, now, schedules) for job in schedules]
+
+    def create(self, fields):
+        job = {
+            'id': str(uuid.uuid4()),
+            'enabled': True,
+            'weekdays': list(range(7)),
+            'normalizeVolume': False,
+            'normalizeTargetDb': -3.0,
+            'lastDeadline': None,
+            'attempts': 0,
+            'lastStatus': None,
+            'lastRequestId': None,
+            'lastResultId': None,
+            'lastRunAt': None,
+            'history': [],
+        }
+        job.update(fields)
+        self._validate(job)
+        with self.lock:
+            schedules = self.load()
+            schedules.append(job)
+            self.save(schedules)
+            logger.info(f"已创建计划任务 {job['id']}: {job['name']} ({job['time']})")
+            return self.describe(job, datetime.now(), schedules)
+
+    def update(self, schedule_id, fields):
+        with self.lock:
+            schedules = self.load()
+            job = next((job for job in schedules if job['id'] == schedule_id), None)
+            if job is None:
+                return None
+            updated = dict(job, **fields)
+            self._validate(updated)
+            # 播出时间、播放列表或输出选项变化后，当前播出时间点需要按新设置重新渲染（失败次数也重新计算）
+            if any(updated.get(key) != job.get(key) for key in RENDER_FIELDS):
+                updated['lastDeadline'] = None
+                updated['attempts'] = 0
+            job.update(updated)
+            self.save(schedules)
+            return self.describe(job, datetime.now(), schedules)
+
+    def delete(self, schedule_id):
+        with self.lock:
+            schedules = self.load()
+            remaining = [job for job in schedules if job['id'] != schedule_id]
+            if len(remaining) == len(schedules):
+                return False
+            self.save(remaining)
+        return True
+
+    def _validate(self, job):
+        if not job.get('name') or not str(job['name']).strip():
+            raise ValueError("必须提供计划任务名称")
+        if not job.get('audioIds'):
+            raise ValueError("没有提供要合并的音频文件ID")
+        if not job.get('outputName') or not str(job['outputName']).strip():
+            raise ValueError("必须提供输出文件名")
+        parse_clock(job.get('time'))
+        weekdays = job.get('weekdays')
+        if not weekdays or any(day not in range(7) for day in weekdays):
+            raise ValueError("weekdays 必须为 0-6 的非空列表（0 表示周一）")
+        job['weekdays'] = sorted(set(weekdays))
+
+    # --- 时间计算 ---
+    def occurrences(self, job, now, days=8):
+        # 依次生成 now 之后的播出时间点
+        minutes = parse_clock(job['time'])
+        for offset in range(days):
+            day = now.date() + timedelta(days=offset)
+            if day.weekday() not in job['weekdays']:
+                continue
+            deadline = datetime.combine(day, time()) + timedelta(minutes=minutes)
+            if deadline > now:
+                yield deadline
+
+    def next_deadline(self, job, now):
+        # 下一个尚未渲染成功（或仍可重试）的播出时间点
+        for deadline in self.occurrences(job, now):
+            if deadline.isoformat() != job.get('lastDeadline'):
+                return deadline
+            if job.get('lastStatus') == 'failed' and job.get('attempts', 0) < MAX_ATTEMPTS:
+                return deadline
+        return None
+
+    def estimate_seconds(self, job, schedules=None):
+        # 优先使用本任务最近几次的最长耗时；没有历史时按音频总时长和全局渲染速率估算
+        history = job.get('history') or []
+        if history:
+            return max(entry['seconds'] for entry in history[-5:])
+
+        source_seconds = self.source_seconds(job['audioIds']) if self.source_seconds else 0
+        ratios = [entry['seconds'] / entry['sourceSeconds']
+                  for other in (schedules or [])
+                  for entry in other.get('history') or []
+                  if entry.get('sourceSeconds')]
+        if source_seconds and ratios:
+            return source_seconds * sum(ratios) / len(ratios)
+        return self.default_estimate
+
+    def planned_start(self, job, deadline, schedules=None):
+        # 开始时间 = 播出时间 - 预计耗时 * 安全系数 - 提前量，并避开高峰时段
+        estimate = self.estimate_seconds(job, schedules) * self.safety_factor
+        start = deadline - timedelta(seconds=estimate + self.lead_margin)
+        return self._shift_off_peak(start, estimate)
+
+    def _shift_off_peak(self, start, estimate):
+        for _ in range(len(self.peak_hours) * 2 + 1):
+            end = start + timedelta(seconds=estimate)
+            clash = self._peak_clash(start, end)
+            if clash is None:
+                break
+            # 提前到高峰时段开始前完成渲染
+            start = clash - timedelta(seconds=estimate)
+        return start
+
+    def _peak_clash(self, start, end):
+        clashes = []
+        day = start.date()
+        while day <= end.date():
+            midnight = datetime.combine(day, time())
+            for start_min, end_min in self.peak_hours:
+                window_start = midnight + timedelta(minutes=start_min)
+                window_end = midnight + timedelta(minutes=end_min)
+                if window_start < end and start < window_end:
+                    clashes.append(window_start)
+            day += timedelta(days=1)
+        return min(clashes) if clashes else None
+
+    def describe(self, job, now, schedules):
+        # 附加下一次播出时间、计划开始时间和预计耗时，供前端展示
+        info = dict(job)
+        info['running'] = job.get('lastStatus') == 'processing'
+        deadline = self.next_deadline(job, now) if job.get('enabled') else None
+        if deadline:
+            info['nextDeadline'] = deadline.isoformat()
+            info['nextStart'] = self.planned_start(job, deadline, schedules).isoformat()
+            info['estimatedSeconds'] = round(self.estimate_seconds(job, schedules), 1)
+        else:
+            info['nextDeadline'] = None
+            info['nextStart'] = None
+            info['estimatedSeconds'] = None
+        return info
+
+    # --- 调度执行 ---
+    def tick(self, now=None):
+        # 检查所有计划任务，提交已到开始时间的渲染
+        now = now or datetime.now()
+        with self.lock:
+            schedules = self.load()
+            changed = False
+            for job in schedules:
+                if job.get('lastStatus') == 'processing':
+                    # 检查正在执行的渲染是否已结束；任务记录不存在时视为失败
+                    task = self.task_status(job['lastRequestId']) if job.get('lastRequestId') else None
+                    if task is not None and task.get('status') not in TERMINAL_STATUSES:
+                        continue
+                    self._finish(job, task or {'status': 'failed'})
+                    changed = True
+                if not job.get('enabled'):
+                    continue
+                deadline = self.next_deadline(job, now)
+                if deadline is None or now < self.planned_start(job, deadline, schedules):
+                    continue
+                self._start(job, deadline, schedules)
+            if changed:
+                self.save(schedules)
+
+    def run_now(self, schedule_id):
+        # 手动触发一次渲染，按下一个播出时间点命名输出
+        with self.lock:
+            schedules = self.load()
+            job = next((job for job in schedules if job['id'] == schedule_id), None)
+            if job is None:
+                return None
+            if job.get('lastStatus') == 'processing':
+                return job.get('lastRequestId')
+            now = datetime.now()
+            deadline = next(self.occurrences(job, now), now)
+            return self._start(job, deadline, schedules)
+
+    def _start(self, job, deadline, schedules):
+        deadline_key = deadline.isoformat()
+        if job.get('lastDeadline') != deadline_key:
+            job['lastDeadline'] = deadline_key
+            job['attempts'] = 0
+        job['attempts'] = job.get('attempts', 0) + 1
+        job['lastRunAt'] = datetime.now().isoformat()
+
+        output_name = f"{job['outputName'].strip()} {deadline:%Y-%m-%d %H:%M}"
+        try:
+            request_id = self.submit_render(job, output_name)
+        except Exception as e:
+            # 提交失败（如源文件已被删除）与渲染失败相同处理：播出前还可以重试，保留上一次成功的输出
+            logger.error(f"提交计划任务 {job['name']} 失败: {e}")
+            job['lastStatus'] = 'failed'
+            self.save(schedules)
+            return None
+
+        job['lastStatus'] = 'processing'
+        job['lastRequestId'] = request_id
+        self.save(schedules)
+        logger.info(f"计划任务 {job['name']} 已提交渲染 (请求ID: {request_id}, 播出时间: {deadline_key})")
+        return request_id
+
+    def _finish(self, job, task):
+        # 记录一次渲染的结果，调用方负责保存
+        status = task.get('status', 'failed')
+        job['lastStatus'] = status
+        elapsed = None
+        if task.get('startedAt') and task.get('finishedAt'):
+            elapsed = task['finishedAt'] - task['startedAt']
+        if status == 'completed' and task.get('fileInfo'):
+            # 只有成功时才替换上一次的输出，失败时保留上一次成功的结果
+            job['lastResultId'] = task['fileInfo']['id']
+            job['attempts'] = 0
+            # 命中渲染缓存时没有实际渲染，耗时不计入历史
+            if elapsed is not None and not task.get('cached'):
+                source_seconds = self.source_seconds(job['audioIds']) if self.source_seconds else 0
+                job['history'] = (job.get('history') or [])[-(HISTORY_LIMIT - 1):] + [
+                    {'seconds': round(elapsed, 2), 'sourceSeconds': source_seconds}]
+        duration = f"，耗时 {elapsed:.1f} 秒" if elapsed is not None else ""
+        logger.info(f"计划任务 {job['name']} 渲染结束: {status}{duration}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="render-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"渲染调度器已启动，检查间隔 {self.poll_interval} 秒")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"渲染调度器检查时出错: {e}")
+            self._stop_event.wait(self.poll_interval)
@@ -0,0 +1,223 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 任务ID只允许作为文件名安全的字符
+TASK_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}$')
+
+# 已结束的任务状态
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class FileLock:
+    """跨进程的文件锁，同一进程内的线程之间可重入。
+
+    多个 uvicorn worker 和合并 worker 进程通过锁文件互斥地"读取-修改-写回"共享的 JSON 文件。
+    POSIX 下使用 fcntl.flock，Windows 下使用 msvcrt.locking。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    if fcntl:
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+                    else:
+                        while True:
+                            try:
+                                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                                break
+                            except OSError:
+                                continue  # LK_LOCK 最多重试 10 秒，继续等待
+                except Exception:
+                    os.close(fd)
+                    raise
+            except Exception:
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def atomic_write_json(path, data):
+    # 先写入同目录下的临时文件再替换，其他进程不会读到写了一半的文件
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TaskStore:
+    """保存在磁盘上的任务状态，供多个 API worker 和合并 worker 进程共享。
+
+    每个任务（或请求）对应目录中的一个 JSON 文件，所有修改都在同一把文件锁内完成。
+    排队中和执行中的合并任务（kind 为 'job'）同时记录在索引文件中，调度和准入检查
+    只需读取索引，不必解析目录中的所有任务文件。
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.lock = FileLock(os.path.join(folder, '.lock'))
+        self.index_file = os.path.join(folder, '.active.json')
+        with self.lock:
+            if not os.path.exists(self.index_file):
+                # 首次使用或索引丢失时，从任务文件重建索引
+                atomic_write_json(self.index_file, {task_id: task for task_id, task in self.all().items()
+                                                    if self._is_active(task)})
+
+    @staticmethod
+    def _is_active(task):
+        return task.get('kind') == 'job' and task.get('status') not in TERMINAL_STATUSES
+
+    @staticmethod
+    def valid_id(task_id):
+        return bool(task_id) and bool(TASK_ID_PATTERN.match(task_id))
+
+    def _path(self, task_id):
+        if not self.valid_id(task_id):
+            raise ValueError(f"无效的任务ID: {task_id}")
+        return os.path.join(self.folder, f"{task_id}.json")
+
+    def get(self, task_id):
+        if not self.valid_id(task_id):
+            return None
+        try:
+            with open(self._path(task_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, Exception) as e:
+            logger.error(f"读取任务 {task_id} 时出错: {e}")
+            return None
+
+    def __contains__(self, task_id):
+        return self.valid_id(task_id) and os.path.exists(self._path(task_id))
+
+    def set(self, task_id, data):
+        with self.lock:
+            now = time.time()
+            data = dict(data, updatedAt=now)
+            # 任务进入已结束状态时，在同一次写入中记录结束时间，读取方不会看到已结束但没有结束时间的任务
+            if data.get('status') in TERMINAL_STATUSES and not data.get('finishedAt'):
+                data['finishedAt'] = now
+            atomic_write_json(self._path(task_id), data)
+            if data.get('kind') == 'job':
+                active = self.active_jobs()
+                if self._is_active(data):
+                    active[task_id] = data
+                else:
+                    active.pop(task_id, None)
+                atomic_write_json(self.index_file, active)
+            return data
+
+    def update(self, task_id, **fields):
+        # 合并字段到已有任务，任务不存在时返回 None
+        with self.lock:
+            task = self.get(task_id)
+            if task is None:
+                return None
+            task.update(fields)
+            return self.set(task_id, task)
+
+    def active_jobs(self):
+        # 排队中和执行中的合并任务 {任务ID: 任务}，只读取索引文件
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, Exception) as e:
+            logger.error(f"读取任务索引时出错: {e}")
+            return {}
+
+    def all(self):
+        tasks = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.name.endswith('.json'):
+                    continue
+                task_id = entry.name[:-len('.json')]
+                task = self.get(task_id)
+                if task is not None:
+                    tasks[task_id] = task
+        return tasks
+
+    def _finished(self, task):
+        # 请求记录在结算前没有结束状态，以其合并任务是否已结束（或已被删除）为准
+        if task.get('status') in TERMINAL_STATUSES:
+            return True
+        if 'jobId' in task:
+            job = self.get(task['jobId'])
+            return job is None or job.get('status') in TERMINAL_STATUSES
+        return False
+
+    def prune(self, max_age):
+        # 删除已结束且超过 max_age 秒未更新的任务。先按文件修改时间筛选，只读取较旧的任务文件；
+        # 每个文件单独加锁，不会长时间阻塞任务进度的更新
+        cutoff = time.time() - max_age
+        candidates = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.name.endswith('.json'):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        candidates.append(entry.name[:-len('.json')])
+                except OSError:
+                    continue  # 扫描期间被删除
+
+        removed = 0
+        for task_id in candidates:
+            with self.lock:
+                task = self.get(task_id)
+                if task and task.get('updatedAt', 0) < cutoff and self._finished(task):
+                    os.remove(self._path(task_id))
+                    removed += 1
+        return removed
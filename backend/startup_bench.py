@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+
+# 冷启动基准测试：反复启动 API 进程，测量从启动到健康检查首次成功的时间，以及第一个列表请求的耗时。
+# embedded 模式与直接运行 uvicorn app:app 相同，启动时同时启动合并调度、定时渲染和存储清理；
+# external 模式为生产模式下的 API worker，后台服务由合并 worker 进程负责。
+# 每轮使用独立的临时数据目录，并预先写入 --items 条元数据，不会影响 uploads/ 和 audio_metadata.json。
+# 用法: python startup_bench.py --runs 5 --items 2000 --mode both
+
+
+def seed_metadata(data_dir, items):
+    # 同时创建对应的空文件，否则 embedded 模式启动时的存储清理会把记录当作孤立记录删除
+    uploads = os.path.join(data_dir, 'uploads')
+    os.makedirs(uploads, exist_ok=True)
+    for i in range(items):
+        open(os.path.join(uploads, f"{i}.mp3"), 'wb').close()
+    metadata = [{
+        'id': str(uuid.uuid4()),
+        'originalName': f"{i}.mp3",
+        'displayName': f"{i}.mp3",
+        'filename': f"{i}.mp3",
+        'path': os.path.join(data_dir, 'uploads', f"{i}.mp3"),
+        'order': (i + 1) * 1024,
+        'duration': 180.0,
+        'merged': False,
+        'hash': uuid.uuid4().hex * 2
+    } for i in range(items)]
+    with open(os.path.join(data_dir, 'audio_metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+
+
+def wait_for(url, started, timeout):
+    # 轮询直到请求成功，返回从进程启动开始经过的秒数
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                response.read()
+                return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.005)
+    return None
+
+
+def timed_get(url):
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=60) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def run_once(mode, port, items, timeout):
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = tempfile.mkdtemp(prefix="radio-startup-")
+    seed_metadata(data_dir, items)
+    env = dict(os.environ, DATA_DIR=data_dir, MERGE_WORKER=mode)
+    base_url = f"http://127.0.0.1:{port}"
+
+    started = time.perf_counter()
+    # 单个 uvicorn 进程，不开启自动重载
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=backend_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = wait_for(f"{base_url}/api/health", started, timeout)
+        if ready is None:
+            return None
+        first_list = timed_get(f"{base_url}/api/audio")
+        second_list = timed_get(f"{base_url}/api/audio")
+        return {'ready': ready, 'firstList': first_list, 'secondList': second_list}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API 进程冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="启动次数")
+    parser.add_argument("--items", type=int, default=2000, help="预先写入的元数据条数")
+    parser.add_argument("--port", type=int, default=8101, help="测试服务器端口")
+    parser.add_argument("--timeout", type=float, default=30, help="等待启动的超时时间（秒）")
+    parser.add_argument("--mode", choices=["embedded", "external", "both"], default="both",
+                        help="API 进程的后台服务模式（MERGE_WORKER）")
+    args = parser.parse_args()
+
+    modes = ["embedded", "external"] if args.mode == "both" else [args.mode]
+    results = {mode: [] for mode in modes}
+    for mode in modes:
+        for run in range(1, args.runs + 1):
+            result = run_once(mode, args.port, args.items, args.timeout)
+            if result is None:
+                print(f"{mode} 第 {run} 次: 服务器启动超时")
+                continue
+            results[mode].append(result)
+            print(f"{mode} 第 {run} 次: 首次响应 {result['ready'] * 1000:.0f} ms, "
+                  f"第一个列表请求 {result['firstList'] * 1000:.1f} ms, 第二个 {result['secondList'] * 1000:.1f} ms")
+
+    print(f"\n{'mode':>8} | {'':>14} | {'median ms':>9} | {'min ms':>7} | {'max ms':>7}")
+    for mode in modes:
+        if not results[mode]:
+            continue
+        for key, label in (('ready', 'time-to-health'), ('firstList', 'first list'), ('secondList', 'second list')):
+            values = [result[key] * 1000 for result in results[mode]]
+            print(f"{mode:>8} | {label:>14} | {statistics.median(values):>9.1f} | {min(values):>7.1f} | "
+                  f"{max(values):>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
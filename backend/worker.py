@@ -0,0 +1,30 @@
+import signal
+import threading
+
+from loguru import logger
+
+
+# 独立的合并 worker 进程：执行合并任务队列、定时渲染和存储清理。
+# 生产模式下由 run.py 启动，API worker 只负责把合并任务写入共享的任务目录
+def run_worker():
+    # 导入 app 模块会完成日志、目录和共享状态的初始化
+    import app
+
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"合并 worker 收到信号 {signum}，正在退出...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    app.start_background_services()
+    # 定时唤醒以便在 Windows 上也能及时响应 Ctrl+C
+    while not stop_event.wait(1):
+        pass
+    app.stop_background_services()
+
+
+if __name__ == "__main__":
+    run_worker()
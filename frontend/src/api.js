@@ -31,6 +31,12 @@ const api = {
     });
   },
 
+  // 获取服务器的上传和合并准入限制
+  getAdmission() {
+    const client = createApiClient();
+    return client.get('/api/admission');
+  },
+
   // 获取待处理音频列表
   getAudioFiles() {
     const client = createApiClient();
@@ -97,10 +103,10 @@ const api = {
     return client.post('/api/check-processing-status', data);
   },
 
-  // 重新排序音频文件
-  reorderAudio(data) {
+  // 移动单个音频文件到指定文件之前（beforeId 为空时移动到末尾）
+  moveAudio(id, data) {
     const client = createApiClient();
-    return client.post('/api/reorder', data);
+    return client.post(`/api/audio/${id}/move`, data);
   },
 
   // 获取下载地址